@@ -0,0 +1,160 @@
+# accumulators.py ---
+#
+# Filename: accumulators.py
+# Description:
+#            Streaming statistics of the atom ensemble, updated in
+#          place on every vectorized step and mergeable across chunks,
+#          so the memory does not grow with the number of atoms or
+#          the simulation length
+# Author:    Yu Lu
+# Email:     yulu@utexas.edu
+# Github:    https://github.com/SuperYuLu
+#
+
+import numpy as np
+
+
+class Moments:
+    """
+    Count, mean and variance of samples of a given shape, by Welford's
+    update generalized to batches (Chan et al.), which also merges
+    """
+    def __init__(self, shape = ()):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)     # sum of squared deviations from the mean
+
+    def _combine(self, count, mean, m2):
+        if count == 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (count / total)
+        self.m2 = self.m2 + m2 + delta**2 * (self.count * count / total)
+        self.count = total
+
+    def update(self, x):
+        """
+        Add a batch of samples in shape (n,) + shape
+        """
+        x = np.asarray(x, dtype = float)
+        if x.shape[0] == 0:
+            return
+        mean = x.mean(axis = 0)
+        self._combine(x.shape[0], mean, ((x - mean)**2).sum(axis = 0))
+
+    def merge(self, other):
+        self._combine(other.count, other.mean, other.m2)
+        return self
+
+    @property
+    def variance(self):
+        """
+        Population variance, 0 without samples
+        """
+        return self.m2 / self.count if self.count else np.zeros_like(self.m2)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+
+class Histogram:
+    """
+    Counts in fixed bins, samples outside go to underflow / overflow
+    """
+    def __init__(self, edges):
+        self.edges = np.asarray(edges, dtype = float)
+        self.counts = np.zeros(self.edges.size - 1, dtype = np.int64)
+        self.underflow = 0
+        self.overflow = 0
+
+    def update(self, x):
+        x = np.asarray(x, dtype = float).ravel()
+        idx = np.searchsorted(self.edges, x, side = 'right') - 1
+        idx[x == self.edges[-1]] = self.counts.size - 1 # last bin is closed, as in np.histogram
+        inside = (idx >= 0) & (idx < self.counts.size)
+        self.counts += np.bincount(idx[inside], minlength = self.counts.size)
+        self.underflow += int((x < self.edges[0]).sum())
+        self.overflow += int((x > self.edges[-1]).sum())
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        return self
+
+
+class LossTally:
+    """
+    Number of atoms lost at each trap index
+    """
+    def __init__(self, numTraps):
+        self.counts = np.zeros(numTraps, dtype = np.int64)
+
+    def update(self, trapIdx):
+        self.counts += np.bincount(np.asarray(trapIdx, dtype = np.intp), minlength = self.counts.size)
+
+    def merge(self, other):
+        self.counts += other.counts
+        return self
+
+
+class PhaseSpaceStats:
+    """
+    Per sample time statistics in the frame co-moving with the synchronous
+    atom: atoms still in the slower, atoms within half a trap spacing of the
+    synchronous atom (in trap) and the moments of their co-moving velocity,
+    histograms of the co-moving z position and velocity of the atoms still in
+    the slower; plus the losses per trap index
+    times: sample times [s]
+    zBins, vBins: histogram edges of the co-moving z [m] and vz [m/s]
+    """
+    def __init__(self, times, zBins, vBins, numTraps, trapSpace):
+        self.times = np.asarray(times, dtype = float)
+        self.zBins = np.asarray(zBins, dtype = float)
+        self.vBins = np.asarray(vBins, dtype = float)
+        self.trapSpace = trapSpace
+        n = self.times.size
+        self.numAlive = np.zeros(n, dtype = np.int64)
+        self.numInTrap = np.zeros(n, dtype = np.int64)
+        self.velocity = [Moments((3,)) for i in range(n)]   # co-moving velocity of the atoms in trap
+        self.zHist = [Histogram(zBins) for i in range(n)]
+        self.vHist = [Histogram(vBins) for i in range(n)]
+        self.losses = LossTally(numTraps)
+
+    def empty(self):
+        """
+        Accumulator of the same sampling with nothing recorded
+        """
+        return PhaseSpaceStats(self.times, self.zBins, self.vBins, self.losses.counts.size, self.trapSpace)
+
+    def record(self, k, dz, dv, lost):
+        """
+        Add the atoms at sample time k
+        dz: co-moving z positions, dv: co-moving velocities in shape (N, 3)
+        """
+        alive = ~lost
+        inTrap = alive & (abs(dz) <= 0.5 * self.trapSpace)
+        self.numAlive[k] += int(alive.sum())
+        self.numInTrap[k] += int(inTrap.sum())
+        self.velocity[k].update(dv[inTrap])
+        self.zHist[k].update(dz[alive])
+        self.vHist[k].update(dv[alive, 2])
+
+    def merge(self, other):
+        self.numAlive += other.numAlive
+        self.numInTrap += other.numInTrap
+        for mine, theirs in zip(self.velocity + self.zHist + self.vHist, other.velocity + other.zHist + other.vHist):
+            mine.merge(theirs)
+        self.losses.merge(other.losses)
+        return self
+
+    def summary(self):
+        """
+        Dict of per sample time arrays: time, alive, inTrap, co-moving mean
+        and std of vz of the atoms in trap
+        """
+        return {'time': self.times, 'alive': self.numAlive, 'inTrap': self.numInTrap,
+                'meanVz': np.array([m.mean[2] for m in self.velocity]),
+                'stdVz': np.array([m.std[2] for m in self.velocity])}
@@ -0,0 +1,35 @@
+# allTrapRun.py --- 
+# 
+# Filename: allTrapRun.py
+# Description: 
+#            Run the field center, peak and depth analysis
+#          for all traps in settings.trapNum in one vectorized
+#          pass, the per trap table is saved to allTrapRun.csv
+# Author:    Yu Lu
+# Email:     yulu@utexas.edu
+# Github:    https://github.com/SuperYuLu 
+# 
+
+from settings import *
+from movingTraps import slower
+import numpy as np 
+
+def main():
+    s = slower(initialV, finalV, accRatio, current)
+    table = s.trapDepthTable(trapNum)
+
+    columns = ['trapNum', 'trapCenter', 'fieldCenter', 'frontPeak', 'backPeak', 'depth', 'comovingDepth']
+    np.savetxt('allTrapRun.csv', np.column_stack([table[c] for c in columns]),
+               delimiter = ',', header = ','.join(columns), comments = '',
+               fmt = ['%d'] + ['%.6e'] * (len(columns) - 1))
+
+    depth = table['comovingDepth']
+    print("\n===============================")
+    print("Traps analyzed: {:d} ({:d} - {:d})".format(depth.size, table['trapNum'][0], table['trapNum'][-1]))
+    print("Co-moving trap depth: min {:.2f} mK (trap {:d})  max {:.2f} mK".format(
+        depth.min(), table['trapNum'][np.argmin(depth)], depth.max()))
+    print("Lab frame trap depth: min {:.2f} mK".format(table['depth'].min()))
+    print("Table saved to allTrapRun.csv")
+    
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+# artifacts.py ---
+#
+# Filename: artifacts.py
+# Description:
+#            Content addressed on-disk cache of the costly numpy
+#          artifacts (on-axis profiles, field grids and gradients):
+#          entries are keyed by a hash of the inputs and of the source
+#          of the code computing them, written atomically and evicted
+#          least recently used first beyond a size budget
+# Author:    Yu Lu
+# Email:     yulu@utexas.edu
+# Github:    https://github.com/SuperYuLu
+#
+# Usage:
+#     MTS_CACHE=~/.mts_cache MTS_CACHE_SIZE=2048 python3 simulator.py    (size budget in MB)
+#
+#     artifacts.configure('cache/', maxBytes = 2**30)
+#     ...
+#     print(artifacts.active().report())
+#
+
+import os
+import sys
+import json
+import atexit
+import zipfile
+import hashlib
+import tempfile
+import numpy as np
+
+
+ENV = 'MTS_CACHE'
+ENV_SIZE = 'MTS_CACHE_SIZE'
+
+_versions = {}  # source file -> hash
+_state = {'cache': None}
+
+
+def codeVersion(*files):
+    """
+    Hash of the given source files, callers pass their own __file__ so it
+    also works when their module runs as a script
+    """
+    sha = hashlib.sha1()
+    for path in files:
+        if path not in _versions:
+            with open(path, 'rb') as f:
+                _versions[path] = hashlib.sha1(f.read()).hexdigest()
+        sha.update(_versions[path].encode())
+    return sha.hexdigest()
+
+
+def _jsonable(value):
+    if isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        return {'sha1': hashlib.sha1(value.tobytes()).hexdigest(), 'shape': value.shape, 'dtype': value.dtype.str}
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError("Cannot hash {:}".format(type(value)))
+
+
+def key(kind, params, code = ''):
+    """
+    Cache key of an artifact: its kind, the input parameters (scalars,
+    sequences or arrays, floats at full precision, arrays by content hash)
+    and the code version
+    """
+    text = json.dumps({'kind': kind, 'params': params, 'code': code}, sort_keys = True, default = _jsonable)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+class ArtifactCache:
+    """
+    Directory of .npz entries, each a dict of arrays; entries are touched
+    on every hit and once the total size exceeds maxBytes the least recently
+    used are evicted down to lowWater of it, the size is tallied on writes
+    in between
+    """
+    lowWater = 0.9
+
+    def __init__(self, directory, maxBytes = 2**30):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytesWritten = 0
+        self._size = 0 # total size as of the last scan, plus the writes since
+        os.makedirs(directory, exist_ok = True)
+        self.evict()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        """
+        Arrays of the entry, None on a miss
+        """
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files}
+            os.utime(path)
+        except (OSError, ValueError, EOFError, zipfile.BadZipFile): # missing, evicted meanwhile or unreadable
+            self.misses += 1
+            return None
+        self.hits += 1
+        return arrays
+
+    def put(self, key, arrays):
+        """
+        Atomically store a dict of arrays, concurrent readers see either no
+        entry or a complete one
+        """
+        fd, tmp = tempfile.mkstemp(dir = self.directory, suffix = '.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        size = os.path.getsize(tmp)
+        path = self._path(key)
+        try:
+            replaced = os.path.getsize(path)
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(tmp, path)
+        self.bytesWritten += size
+        self._size += size - replaced
+        if self._size > self.maxBytes:
+            self.evict()
+
+    def cached(self, key, compute):
+        """
+        Entry of key, computed by compute() (a dict of arrays, or None which
+        is not stored) and stored on a miss
+        """
+        arrays = self.get(key)
+        if arrays is None:
+            arrays = compute()
+            if arrays is not None:
+                self.put(key, arrays)
+        return arrays
+
+    def entries(self):
+        """
+        (last use, size, path) of the entries, least recently used first
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npz'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def size(self):
+        return sum(size for mtime, size, path in self.entries())
+
+    def evict(self):
+        """
+        Rescan the directory, shared with other processes, and if over
+        budget evict down to lowWater * maxBytes
+        """
+        entries = self.entries()
+        total = sum(size for mtime, size, path in entries)
+        target = self.maxBytes if total <= self.maxBytes else self.lowWater * self.maxBytes
+        for mtime, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except FileNotFoundError: # evicted by another worker
+                pass
+            total -= size
+        self._size = total
+
+    def clear(self):
+        for mtime, size, path in self.entries():
+            os.remove(path)
+        self._size = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'bytesWritten': self.bytesWritten}
+
+    def report(self):
+        calls = self.hits + self.misses
+        return "[*] Artifact cache {:}: {:d} hits, {:d} misses ({:.0%} hit rate), {:d} evictions, {:.1f} of {:.1f} MB".format(
+            self.directory, self.hits, self.misses, self.hits / calls if calls else 0, self.evictions,
+            self.size() / 2**20, self.maxBytes / 2**20)
+
+
+def configure(directory, maxBytes = 2**30):
+    """
+    Cache the artifacts in directory from now on
+    """
+    _state['cache'] = ArtifactCache(directory, maxBytes)
+    return _state['cache']
+
+
+def disable():
+    _state['cache'] = None
+
+
+def active():
+    """
+    The configured cache, None if caching is off
+    """
+    return _state['cache']
+
+
+def _atexit_report():
+    if _state['cache'] is not None:
+        print(_state['cache'].report(), file = sys.stderr)
+
+
+if os.environ.get(ENV):
+    configure(os.path.expanduser(os.environ[ENV]), float(os.environ.get(ENV_SIZE, 1024)) * 2**20)
+    atexit.register(_atexit_report)
@@ -0,0 +1,197 @@
+# benchmark.py ---
+#
+# Filename: benchmark.py
+# Description:
+#            Timing of the field, schedule and loading hot paths,
+#          results are saved as json baselines and later runs are
+#          compared against them to flag slowdowns
+# Author:    Yu Lu
+# Email:     yulu@utexas.edu
+# Github:    https://github.com/SuperYuLu
+#
+# Usage:
+#     python3 benchmark.py --save bench.json
+#     python3 benchmark.py --compare bench.json --threshold 0.2
+#
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+
+import numpy as np
+import settings
+from movingTraps import slower, singleTrap
+from slower import Slower
+from magfield import MagField, LocalField
+
+
+def syntheticFieldMap(path, rows, cols, resolution = 5e-4):
+    """
+    Write a field map csv of rows x cols grid nodes in the x_y_z_Bx_By_Bz.csv format
+    """
+    r = np.arange(rows) * resolution
+    z = (np.arange(cols) - cols // 2) * resolution
+    R, Z = np.meshgrid(r, z, indexing = 'ij')
+    R, Z = R.ravel(), Z.ravel()
+    data = np.column_stack([R, np.zeros_like(R), Z, R * Z, np.zeros_like(R), 1 + Z**2 - R**2 / 2])
+    np.savetxt(path, data, delimiter = ',', header = 'x,y,z,Bx,By,Bz', comments = '', fmt = '%.6g')
+    return path
+
+
+def timeCall(func, setup = None, repeat = 5, minTime = 0.05):
+    """
+    Best time per call [s] of func over repeat runs, each run making enough
+    calls to last minTime; setup (not timed) runs before each call
+    """
+    def measure(number):
+        total = 0
+        for _ in range(number):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            func()
+            total += time.perf_counter() - start
+        return total
+
+    number = 1
+    while True:
+        total = measure(number)
+        if total >= minTime:
+            break
+        number = max(2 * number, int(number * minTime / max(total, 1e-9)))
+    best = total / number
+    for _ in range(repeat - 1):
+        best = min(best, measure(number) / number)
+    return best
+
+
+def clearSchedules():
+    slower._schedules.clear()
+
+
+def freshMagField(source):
+    def build():
+        build.field = MagField(resolution = 5e-4, source_file = source, current = 400)
+    return build
+
+
+def benchmarks(workdir, quick = False):
+    """
+    Named benchmarks: name -> (func, setup)
+    """
+    small = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'x_y_z_Bx_By_Bz.csv')
+    large = syntheticFieldMap(os.path.join(workdir, 'large.csv'), *((51, 401) if quick else (101, 2001)))
+    smallField, largeField = freshMagField(small), freshMagField(large)
+
+    trap = singleTrap(settings.singleTrapRunNum, settings.initialV, settings.finalV, settings.accRatio, settings.current)
+    allTraps = slower(settings.initialV, settings.finalV, settings.accRatio, settings.current)
+    field = MagField(resolution = 5e-4, source_file = small, current = 400)
+    local = LocalField(field.cache, origin = (0, field.leftBound), resolution = field.resolution)
+    local.gradient
+    rng = np.random.default_rng(0)
+    rMax = (local.shape[0] - 1) * local.resolution
+
+    def positions(n):
+        return np.column_stack([rng.uniform(-rMax, rMax, (n, 2)) / np.sqrt(2),
+                                rng.uniform(field.leftBound, field.rightBound, n)])
+
+    def slowerArrays():
+        s = Slower(settings.initialV, settings.finalV, settings.accRatio)
+        s.trapOnTime, s.trapOffTime, s.trapPulseLength, s.trapLeftCoil, s.trapRightCoil
+
+    cases = {
+        'singleTrap.onAxisMagField': (lambda: trap.onAxisMagField(), None),
+        'slower.trapsOnAxisMagField[all]': (lambda: allTraps.trapsOnAxisMagField(), None),
+        'singleTrap[settings.trapNum]': (lambda: [singleTrap(n, settings.initialV, settings.finalV, settings.accRatio,
+                                                             settings.current) for n in settings.trapNum],
+                                         clearSchedules),
+        'Slower.__init__': (lambda: Slower(settings.initialV, settings.finalV, settings.accRatio), None),
+        'Slower.__init__+arrays': (slowerArrays, None),
+        'MagField.cache[small]': (lambda: smallField.field.cache, smallField),
+        'MagField.cache[large]': (lambda: largeField.field.cache, largeField),
+        'LocalField.get_gradient': (lambda: local.get_gradient((1e-3, 0, 0)), None),
+    }
+    for n in ([1, 1000, 100000] if quick else [1, 1000, 100000, 1000000]):
+        xyz = positions(n)
+        cases['LocalField.get_gradients[{:d}]'.format(n)] = (lambda xyz = xyz: local.get_gradients(xyz), None)
+    return cases
+
+
+def run(selection = None, quick = False, repeat = 5, minTime = 0.05):
+    workdir = tempfile.mkdtemp()
+    stdout = sys.stdout
+    results = {}
+    try:
+        for name, (func, setup) in benchmarks(workdir, quick).items():
+            if selection and selection not in name:
+                continue
+            sys.stdout = open(os.devnull, 'w') # silence the loading messages
+            try:
+                results[name] = timeCall(func, setup, repeat, minTime)
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+            print("{:<40} {:>12.3f} ms".format(name, results[name] * 1e3))
+    finally:
+        sys.stdout = stdout
+        shutil.rmtree(workdir)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Print the ratio to the baseline for each benchmark
+    return: names of benchmarks slower than the baseline by more than threshold
+    """
+    slowdowns = []
+    print("\n{:<40} {:>12} {:>12} {:>8}".format('benchmark', 'baseline', 'current', 'ratio'))
+    for name, seconds in results.items():
+        if name not in baseline:
+            print("{:<40} {:>12} {:>9.3f} ms {:>8}".format(name, '-', seconds * 1e3, 'new'))
+            continue
+        ratio = seconds / baseline[name]
+        flag = ''
+        if ratio > 1 + threshold:
+            slowdowns.append(name)
+            flag = '  [!] slower'
+        print("{:<40} {:>9.3f} ms {:>9.3f} ms {:>8.2f}{:}".format(name, baseline[name] * 1e3, seconds * 1e3, ratio, flag))
+    return slowdowns
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmark the field, schedule and loading hot paths')
+    parser.add_argument('--save', help = 'save results as a json baseline')
+    parser.add_argument('--compare', help = 'json baseline to compare against')
+    parser.add_argument('--threshold', type = float, default = 0.2, help = 'allowed relative slowdown')
+    parser.add_argument('--filter', help = 'only run benchmarks whose name contains this')
+    parser.add_argument('--repeat', type = int, default = 5)
+    parser.add_argument('--min-time', type = float, default = 0.05, help = 'minimum duration of each timed run [s]')
+    parser.add_argument('--quick', action = 'store_true', help = 'smaller synthetic maps and batches')
+    args = parser.parse_args()
+
+    results = run(args.filter, args.quick, args.repeat, args.min_time)
+    if args.save:
+        meta = {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.platform(),
+                'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'quick': args.quick, 'repeat': args.repeat,
+                'minTime': args.min_time}
+        with open(args.save, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent = 1)
+        print("[*] Baseline saved to {:}".format(args.save))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        slowdowns = compare(results, baseline, args.threshold)
+        if slowdowns:
+            print("[!] {:d} benchmarks slower than baseline by more than {:.0%}".format(len(slowdowns), args.threshold))
+            sys.exit(1)
+        print("[*] No slowdowns beyond {:.0%}".format(args.threshold))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# checkpoint.py ---
+#
+# Filename: checkpoint.py
+# Description:
+#            Periodic checkpoints of long runs: numpy arrays (particle
+#          states) and pickled python objects (run context, partial
+#          results, accumulators) in one .npz file, rewritten atomically
+#          so a killed job always leaves a complete checkpoint behind
+# Author:    Yu Lu
+# Email:     yulu@utexas.edu
+# Github:    https://github.com/SuperYuLu
+#
+
+import os
+import time
+import pickle
+import tempfile
+import numpy as np
+
+
+def save(path, arrays, objects, compress = False):
+    """
+    Atomically write arrays (name -> ndarray) and picklable objects
+    """
+    fd, tmp = tempfile.mkstemp(dir = os.path.dirname(os.path.abspath(path)), suffix = '.tmp')
+    blob = np.frombuffer(pickle.dumps(objects, protocol = pickle.HIGHEST_PROTOCOL), dtype = np.uint8)
+    with os.fdopen(fd, 'wb') as f:
+        (np.savez_compressed if compress else np.savez)(f, _objects = blob, **arrays)
+    os.replace(tmp, path)
+
+
+def load(path):
+    """
+    return: arrays, objects
+    """
+    with np.load(path) as data:
+        arrays = {name: data[name] for name in data.files if name != '_objects'}
+        objects = pickle.loads(data['_objects'].tobytes())
+    return arrays, objects
+
+
+class Checkpointer:
+    """
+    Writes a checkpoint to path at most every `every` seconds of wall time,
+    keeping track of the time spent doing so
+    """
+    def __init__(self, path, every = 600., compress = False):
+        self.path = path
+        self.every = every
+        self.compress = compress
+        self.count = 0
+        self.seconds = 0.       # spent writing checkpoints
+        self.started = self.last = time.monotonic()
+
+    def due(self):
+        return time.monotonic() - self.last >= self.every
+
+    def save(self, arrays, objects):
+        start = time.monotonic()
+        save(self.path, arrays, objects, self.compress)
+        self.last = time.monotonic()
+        self.seconds += self.last - start
+        self.count += 1
+
+    def overhead(self):
+        """
+        Fraction of the wall time since start spent writing checkpoints
+        """
+        return self.seconds / max(time.monotonic() - self.started, 1e-9)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,110 @@
+# coilfield.py ---
+#
+# Filename: coilfield.py
+# Description:
+#            Analytic off-axis magnetic field of the trap coils,
+#          exact circular loop fields (elliptic integrals) summed
+#          over every winding, packed as a LocalField map
+# Author:    Yu Lu
+# Email:     yulu@utexas.edu
+# Github:    https://github.com/SuperYuLu
+#
+
+import numpy as np
+import artifacts
+from movingTraps import slower, u0
+from magfield import LocalField
+
+
+def ellipke(m, tol = 1e-15, maxIter = 40):
+    """
+    Complete elliptic integrals of the first and second kind K(m), E(m)
+    with parameter m = k^2, by the arithmetic-geometric mean
+    """
+    m = np.asarray(m, dtype = float)
+    a = np.ones_like(m)
+    b = np.sqrt(1 - m)
+    c = np.sqrt(m)
+    total = 0.5 * c**2
+    power = 0.5
+    for _ in range(maxIter):
+        if np.all(abs(c) < tol):
+            break
+        a, b, c = (a + b) / 2, np.sqrt(a * b), (a - b) / 2
+        power *= 2
+        total += power * c**2
+
+    with np.errstate(divide = 'ignore'):
+        K = np.pi / (2 * a)
+    E = K * (1 - total)
+    return K, E
+
+
+def loopField(r, z, radius, current):
+    """
+    Exact field of a single circular current loop centered at the origin
+    r, z: position from the loop center, r >= 0
+    return: B_r, B_z
+    """
+    r, z = np.broadcast_arrays(np.asarray(r, dtype = float), np.asarray(z, dtype = float))
+    rho2 = radius**2 + r**2 + z**2
+    alpha2 = rho2 - 2 * radius * r
+    beta2 = rho2 + 2 * radius * r
+    beta = np.sqrt(beta2)
+    K, E = ellipke(1 - alpha2 / beta2)
+    C = u0 * current / np.pi
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        Bz = C / (2 * alpha2 * beta) * ((radius**2 - r**2 - z**2) * E + alpha2 * K)
+        Br = C * z / (2 * alpha2 * beta * r) * (rho2 * E - alpha2 * K)
+    Br = np.where(r == 0, 0, Br) # vanishes on axis
+    return Br, Bz
+
+
+def trapField(r, z, current, windings = None):
+    """
+    Off-axis field of a single trap, summed over all windings
+    r, z: position from the trap center
+    windings: (position, radius, current sign), default slower.windings()
+    return: B_r, B_z
+    """
+    pos, radius, sign = slower.windings() if windings is None else windings
+    r, z = np.broadcast_arrays(np.asarray(r, dtype = float), np.asarray(z, dtype = float))
+    Br = np.zeros(r.shape)
+    Bz = np.zeros(r.shape)
+    for p, a, s in zip(pos, radius, sign): # each winding is a full grid evaluation
+        br, bz = loopField(r, z - p, a, s * current)
+        Br += br
+        Bz += bz
+    return Br, Bz
+
+
+def trapLocalField(current = 400, rMax = 5e-3, zHalf = 10e-3, resolution = 5e-4, windings = None):
+    """
+    Generate the field map of a single trap on the grid r in [0, rMax],
+    z in [-zHalf, zHalf] (from the trap center), channels as in
+    MagField.cache: Bx(=B_r in the x-z plane), By(=0), Bz
+    """
+    windings = slower.windings() if windings is None else windings
+    r = np.arange(int(np.rint(rMax / resolution)) + 1) * resolution
+    z = np.arange(-int(np.rint(zHalf / resolution)), int(np.rint(zHalf / resolution)) + 1) * resolution
+
+    def build():
+        Br, Bz = trapField(r[:, None], z[None, :], current, windings)
+        field = np.zeros([r.size, z.size, 3])
+        field[:, :, 0] = Br
+        field[:, :, 2] = Bz
+        return {'field': field}
+
+    cache = artifacts.active()
+    if cache is None:
+        return LocalField(build()['field'], origin = (0, z[0]), resolution = resolution)
+    key = artifacts.key('trapLocalField', {'r': r, 'z': z, 'current': current, 'windings': list(windings)},
+                        artifacts.codeVersion(__file__))
+    return LocalField(cache.cached(key, build)['field'], origin = (0, z[0]), resolution = resolution, key = key)
+
+
+if __name__ == '__main__':
+    field = trapLocalField(current = 400)
+    print(field.field.shape)
+    print(field.get_gradient((0, 0, 0)))
@@ -0,0 +1,205 @@
+# ensemble.py ---
+#
+# Filename: ensemble.py
+# Description:
+#            Sharded Monte Carlo ensembles: the atoms are split in
+#          blocks of Simulator.chunkSize with their own random streams,
+#          shards (groups of blocks) run in a process pool or through a
+#          file based work queue, and the per block partial results are
+#          merged in block order, so the answer does not depend on the
+#          shard count or the order the shards finish
+# Author:    Yu Lu
+# Email:     yulu@utexas.edu
+# Github:    https://github.com/SuperYuLu
+#
+# Usage:
+#     Ensemble(sim, nAtoms = 10**6, seed = 1).run(shards = 16)
+#
+#     queue = WorkQueue('queue/')           # shared directory
+#     queue.submit(Ensemble(sim, 10**6, seed = 1), shards = 64)
+#     python3 ensemble.py queue/            # on any number of machines
+#     result = queue.collect()
+#
+
+import os
+import sys
+import time
+import pickle
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from simulator import SimulationResult
+
+
+def splitBlocks(numBlocks, numShards):
+    """
+    Split blocks 0 .. numBlocks - 1 into numShards contiguous groups
+    """
+    edges = np.linspace(0, numBlocks, min(numShards, numBlocks) + 1).round().astype(int)
+    return [list(range(a, b)) for a, b in zip(edges[:-1], edges[1:])]
+
+
+def _runShard(ensemble, blocks):
+    return {block: ensemble.runBlock(block) for block in blocks}
+
+
+def _dump(obj, path):
+    """
+    Atomic pickle, readers never see a partial file
+    """
+    fd, tmp = tempfile.mkstemp(dir = os.path.dirname(path) or '.', suffix = '.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        pickle.dump(obj, f)
+    os.replace(tmp, path)
+
+
+def _load(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+class Ensemble:
+    """
+    nAtoms atoms of beam pushed through simulator, seed fixes the random
+    streams of all blocks (fresh entropy if None, kept in self.entropy)
+    """
+    def __init__(self, simulator, nAtoms, beam = None, seed = None, velocityBins = None):
+        if simulator.writer is not None:
+            raise ValueError("Sharded runs do not stream states, set the simulator writer to None")
+        self.simulator = simulator
+        self.nAtoms = nAtoms
+        self.beam, self.velocityBins = simulator.defaults(beam, velocityBins)
+        self.entropy = np.random.SeedSequence(seed).entropy
+        self.numBlocks = simulator.numBlocks(nAtoms)
+
+    def runBlock(self, block):
+        return self.simulator.runBlock(block, self.nAtoms, self.beam, self.entropy, self.velocityBins)
+
+    def merge(self, partials):
+        """
+        Merge {block: SimulationResult} in block order
+        """
+        missing = set(range(self.numBlocks)) - set(partials)
+        if missing:
+            raise ValueError("Missing results of {:d} blocks, e.g. block {:d}".format(len(missing), min(missing)))
+        result = SimulationResult(self.velocityBins)
+        for block in range(self.numBlocks):
+            result.merge(partials[block])
+        return result
+
+    def run(self, shards = None, workers = None):
+        """
+        Run the shards (default one per worker) in a process pool
+        return: merged SimulationResult
+        """
+        numShards = shards or workers or os.cpu_count()
+        partials = {}
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(_runShard, self, blocks) for blocks in splitBlocks(self.numBlocks, numShards)]
+            for future in futures:
+                partials.update(future.result())
+        return self.merge(partials)
+
+
+class WorkQueue:
+    """
+    Shard queue in a shared directory: a shard file moves todo/ -> running/
+    by atomic rename when a worker claims it, its partial results land in
+    done/ and the claim is dropped; shards of failed workers are put back
+    with requeue(), a shard requeued while still running may run twice and
+    gives the same partial results
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        for name in ('todo', 'running', 'done'):
+            os.makedirs(os.path.join(directory, name), exist_ok = True)
+
+    def _path(self, *names):
+        return os.path.join(self.directory, *names)
+
+    def submit(self, ensemble, shards = 1):
+        _dump(ensemble, self._path('ensemble.pkl'))
+        for i, blocks in enumerate(splitBlocks(ensemble.numBlocks, shards)):
+            _dump(blocks, self._path('todo', 'shard_{:05d}.pkl'.format(i)))
+
+    def claim(self):
+        """
+        Take a pending shard, None when the queue is empty
+        """
+        for name in sorted(os.listdir(self._path('todo'))):
+            try:
+                os.rename(self._path('todo', name), self._path('running', name))
+                os.utime(self._path('running', name)) # claim time, see requeue()
+            except FileNotFoundError: # claimed by another worker
+                continue
+            return name
+        return None
+
+    def work(self):
+        """
+        Run shards until none is left
+        return: number of shards run
+        """
+        ensemble = _load(self._path('ensemble.pkl'))
+        count = 0
+        while True:
+            name = self.claim()
+            if name is None:
+                return count
+            if os.path.exists(self._path('done', name)): # requeued after it finished
+                self._drop(name)
+                continue
+            blocks = _load(self._path('running', name))
+            _dump(_runShard(ensemble, blocks), self._path('done', name))
+            self._drop(name)
+            count += 1
+            print("[*] Shard {:} done ({:d} blocks)".format(name, len(blocks)))
+
+    def _drop(self, name):
+        try:
+            os.remove(self._path('running', name))
+        except FileNotFoundError: # requeued meanwhile
+            pass
+
+    def requeue(self, olderThan = 0.):
+        """
+        Put shards claimed more than olderThan seconds ago and never finished
+        back in todo; while workers may still be running, olderThan should
+        exceed the time a shard takes
+        return: number of shards requeued
+        """
+        now = time.time()
+        count = 0
+        for name in os.listdir(self._path('running')):
+            path = self._path('running', name)
+            try:
+                if now - os.stat(path).st_mtime < olderThan:
+                    continue
+                os.rename(path, self._path('todo', name))
+            except FileNotFoundError: # finished meanwhile
+                continue
+            count += 1
+        return count
+
+    def status(self):
+        return {name: len(os.listdir(self._path(name))) for name in ('todo', 'running', 'done')}
+
+    def collect(self):
+        """
+        Merged result of the finished shards, raises if any is missing
+        """
+        ensemble = _load(self._path('ensemble.pkl'))
+        partials = {}
+        for name in sorted(os.listdir(self._path('done'))):
+            if name.endswith('.pkl'):
+                partials.update(_load(self._path('done', name)))
+        return ensemble.merge(partials)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("Usage: python3 ensemble.py <queue directory>")
+        sys.exit(1)
+    queue = WorkQueue(sys.argv[1])
+    print("[*] Ran {:d} shards, queue: {:}".format(queue.work(), queue.status()))
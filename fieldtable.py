@@ -0,0 +1,106 @@
+# fieldtable.py ---
+#
+# Filename: fieldtable.py
+# Description:
+#            Translation invariant lookup table of the single trap
+#          field; all traps share the coil geometry, so any trap's
+#          field is the tabulated profile shifted to its center and
+#          scaled by its current
+# Author:    Yu Lu
+# Email:     yulu@utexas.edu
+# Github:    https://github.com/SuperYuLu
+#
+
+import numpy as np
+from movingTraps import slower, onAxisField
+from coilfield import trapLocalField, trapField
+
+
+class TrapFieldTable:
+    """
+    On-axis field profile of a single trap at unit current, sampled on a
+    uniform grid fine and long enough that linear interpolation plus the
+    truncated tail stay within tol * (peak field)
+    """
+    def __init__(self, tol = 1e-4, windings = None):
+        self.tol = tol # error tolerance relative to the peak field
+        self.windings = slower.windings() if windings is None else windings
+        self.zHalf, self.step = self._sampling()
+
+        n = int(np.rint(self.zHalf / self.step))
+        self.z = np.arange(-n, n + 1) * self.step
+        self.profile = self._exact(self.z)
+
+    def _exact(self, z):
+        return onAxisField(np.atleast_2d(z), [0.], 1, self.windings)[0]
+
+    def _sampling(self):
+        """
+        Table half length and step, half of the error budget each for the
+        truncated tail and the linear interpolation
+        """
+        budget = 0.5 * self.tol * abs(self._exact(np.linspace(-slower.coilSpace, slower.coilSpace, 1001))).max()
+
+        zHalf = 2 * slower.coilSpace
+        while abs(self._exact(np.array([-zHalf, zHalf]))).max() > budget:
+            zHalf *= 2
+
+        step = slower.wireDia
+        while True:
+            z = np.arange(-zHalf, zHalf + step / 2, step)
+            mid = z[:-1] + step / 2
+            error = abs(np.interp(mid, z, self._exact(z)) - self._exact(mid)).max()
+            if error <= budget:
+                return zHalf, step
+            step /= 2
+
+    def onAxis(self, z, centers, current = 1, signs = None):
+        """
+        On-axis field of traps at centers (scaled by current and the per trap
+        current signs), z shared lab frame grid or one row per trap
+        return: B in shape (traps, z), 0 beyond the table range
+        """
+        centers = np.asarray(centers, dtype = float)
+        z = np.broadcast_to(np.asarray(z, dtype = float), (centers.size, np.shape(z)[-1]))
+
+        f = (z - centers[:, None] - self.z[0]) / self.step # fractional table index
+        inside = (f >= 0) & (f <= self.z.size - 1)
+        f = np.where(inside, f, 0)
+        i = np.minimum(f.astype(np.intp), self.z.size - 2)
+        t = f - i
+        B = np.where(inside, (1 - t) * self.profile[i] + t * self.profile[i + 1], 0)
+
+        scale = current * (np.ones(centers.size) if signs is None else np.asarray(signs))
+        return B * scale[:, None]
+
+    def fieldMap(self, rMax = 4e-3, current = 1, resolution = 5e-4, minResolution = 1e-5, samples = 2000, seed = 0):
+        """
+        Off-axis (r, z) map of a single trap over the table z range as a
+        LocalField; the resolution is halved until bilinear interpolation
+        of |B| meets the tolerance at random sample positions
+        """
+        rng = np.random.default_rng(seed)
+        r = rng.uniform(0, rMax, samples)
+        z = rng.uniform(-self.zHalf, self.zHalf, samples)
+        exact = np.hypot(*trapField(r, z, current, self.windings))
+        budget = self.tol * abs(self.profile).max() * abs(current)
+
+        while True:
+            field = trapLocalField(current, rMax, self.zHalf, resolution, self.windings)
+            (Br, Bz), inside = field.interpolate([field.channel('Bx'), field.channel('Bz')], r, z)
+            error = abs(np.hypot(Br, Bz) - exact)[inside].max()
+            if error <= budget or resolution / 2 < minResolution:
+                if error > budget:
+                    print("[!] Field map error {:.2e} T above tolerance at minimum resolution".format(error))
+                return field
+            resolution /= 2
+
+
+if __name__ == '__main__':
+    table = TrapFieldTable(tol = 1e-4)
+    print("Table: +/- {:.1f} mm, step {:.2f} um, {:d} samples".format(
+        table.zHalf * 1e3, table.step * 1e6, table.z.size))
+    s = slower(480, 50, 1, 400)
+    z, B, B_eff = s.trapsOnAxisMagField()
+    Bt = table.onAxis(z, s.trapSpace * np.arange(s.numTraps), s.current)
+    print("Max error vs full winding sum: {:.2e} T (peak {:.2f} T)".format(abs(Bt - B).max(), abs(B).max()))
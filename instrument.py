@@ -0,0 +1,187 @@
+# instrument.py ---
+#
+# Filename: instrument.py
+# Description:
+#            Opt-in instrumentation of the hot paths: call counts,
+#          wall time and peak array allocation per function, with a
+#          summary report. Nothing is wrapped unless enabled, by the
+#          MTS_PROFILE environment variable or the profiling()
+#          context manager, so it costs nothing when off
+# Author:    Yu Lu
+# Email:     yulu@utexas.edu
+# Github:    https://github.com/SuperYuLu
+#
+# Usage:
+#     MTS_PROFILE=1 python3 simulator.py      (MTS_PROFILE=time skips memory tracking)
+#
+#     with instrument.profiling():
+#         ...
+#     print(instrument.report())
+#
+
+import os
+import sys
+import time
+import atexit
+import functools
+import tracemalloc
+from contextlib import contextmanager
+
+
+ENV = 'MTS_PROFILE'
+
+# instrumented functions and properties of each module
+TARGETS = {
+    'magfield': ['MagField.load', 'MagField.cache', 'LocalField.gradient',
+                 'LocalField.get_gradient', 'LocalField.get_gradients'],
+    'movingTraps': ['singleTrap.onAxisMagField', 'slower.trapsOnAxisMagField'],
+    'slower': ['Slower._derive', 'Slower._trapCenter', 'Slower._trapLeftCoil', 'Slower._trapRightCoil',
+               'Slower._trapVelocity', 'Slower._trapCenterTime', 'Slower._trapOnTime',
+               'Slower._trapOffTime', 'Slower._trapPulseLength'],
+}
+
+
+class Stat:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.time = 0.
+        self.peak = 0 # [bytes] largest allocation peak of a single call
+
+
+stats = {}          # 'module.Class.attr' -> Stat
+_namespaces = {}    # module name -> namespace registered at import
+_originals = {}     # (module, target) -> original class attribute
+_stack = []         # allocation peaks observed by the active instrumented calls
+_state = {'enabled': False, 'memory': False}
+
+
+def _timed(name, func):
+    stat = stats.setdefault(name, Stat())
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        memory = _state['memory'] and tracemalloc.is_tracing()
+        if memory:
+            start, peak = tracemalloc.get_traced_memory()
+            if _stack:
+                _stack[-1] = max(_stack[-1], peak) # keep the caller's peak before resetting
+            tracemalloc.reset_peak()
+            _stack.append(start)
+        t0 = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stat.time += time.perf_counter() - t0
+            stat.calls += 1
+            if memory:
+                peak = max(_stack.pop(), tracemalloc.get_traced_memory()[1])
+                stat.peak = max(stat.peak, peak - start)
+                if _stack:
+                    _stack[-1] = max(_stack[-1], peak)
+    return wrapper
+
+
+def _patch(module, namespace):
+    for target in TARGETS.get(module, []):
+        if (module, target) in _originals:
+            continue
+        clsName, attr = target.split('.')
+        cls = namespace[clsName]
+        original = cls.__dict__[attr]
+        name = module + '.' + target
+        if isinstance(original, property):
+            wrapped = property(_timed(name, original.fget), original.fset, original.fdel, original.__doc__)
+        else:
+            wrapped = _timed(name, original)
+        setattr(cls, attr, wrapped)
+        _originals[(module, target)] = (cls, attr, original)
+
+
+def register(module, namespace):
+    """
+    Called at the end of each instrumented module, patches it right away
+    when instrumentation is on
+    """
+    _namespaces[module] = namespace
+    if _state['enabled']:
+        _patch(module, namespace)
+
+
+def enable(memory = True):
+    """
+    Instrument the registered modules, and the ones imported later;
+    memory tracking (tracemalloc) slows numpy heavy code down noticeably,
+    and needs python 3.9+ (tracemalloc.reset_peak)
+    """
+    if memory and not hasattr(tracemalloc, 'reset_peak'):
+        print("[!] Memory tracking needs python 3.9+, timing only", file = sys.stderr)
+        memory = False
+    _state['enabled'] = True
+    _state['memory'] = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    for module, namespace in _namespaces.items():
+        _patch(module, namespace)
+
+
+def disable():
+    """
+    Restore the original functions, statistics are kept
+    """
+    for cls, attr, original in _originals.values():
+        setattr(cls, attr, original)
+    _originals.clear()
+    _state['enabled'] = False
+    if _state['memory'] and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def reset():
+    """
+    Zero the statistics, in place since the active wrappers hold them
+    """
+    for stat in stats.values():
+        stat.reset()
+
+
+@contextmanager
+def profiling(memory = True):
+    """
+    Instrument the hot paths within the block, yields the statistics;
+    instrumentation already on (e.g. by MTS_PROFILE) is left on after it
+    """
+    enabled = _state['enabled']
+    if not enabled:
+        enable(memory)
+    try:
+        yield stats
+    finally:
+        if not enabled:
+            disable()
+
+
+def report():
+    """
+    Per function summary, sorted by total time
+    """
+    lines = ["{:<40} {:>8} {:>12} {:>12} {:>12}".format('function', 'calls', 'total [ms]', 'mean [ms]', 'peak [MB]')]
+    for name, stat in sorted(stats.items(), key = lambda item: -item[1].time):
+        if stat.calls == 0:
+            continue
+        lines.append("{:<40} {:>8d} {:>12.3f} {:>12.4f} {:>12}".format(
+            name, stat.calls, stat.time * 1e3, stat.time / stat.calls * 1e3,
+            '{:.3f}'.format(stat.peak / 2**20) if _state['memory'] or stat.peak else '-'))
+    return '\n'.join(lines)
+
+
+def _atexit_report():
+    print("\n[*] Hot path profile ({:}={:})".format(ENV, os.environ.get(ENV)), file = sys.stderr)
+    print(report(), file = sys.stderr)
+
+
+if os.environ.get(ENV, '0') not in ('', '0'):
+    enable(memory = os.environ[ENV] != 'time')
+    atexit.register(_atexit_report)
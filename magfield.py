@@ -15,8 +15,12 @@
 # 
 
 import os
-import pandas as pd
+import json
+import hashlib
+import tempfile
 import numpy as np
+import instrument
+import artifacts
 
 
 class LocalField:
@@ -24,36 +28,135 @@ class LocalField:
     Magnetic field opteration class
     """
     
-    def __init__(self, field, origin = (0, 0), resolution = 0.001):
-        self.field = field
+    def __init__(self, field, origin = (0, 0), resolution = 0.001, channels = ('Bx', 'By', 'Bz'), key = None):
+        self.field = field       # [r, z, channel], None for maps storing |B| only (see compact)
         self.origin = origin
         self.resolution = resolution
+        self.channels = channels # names of the field channels, Bx being B_r on the x-z plane
+        self.key = key           # identity of the field content, e.g. MagField.digest(), enables the artifact cache
+
+    @property
+    def shape(self):
+        """
+        Grid shape (r, z)
+        """
+        if self.field is None:
+            return self._absfield.shape
+        return self.field.shape[:2]
+
+    @property
+    def nbytes(self):
+        """
+        Memory held by the map and its cached gradients
+        """
+        arrays = [] if self.field is None else [self.field]
+        for name in ('_absfield', '_gradient', '_field_gradient'):
+            value = getattr(self, name, None)
+            if value is not None:
+                arrays += value if isinstance(value, (list, tuple)) else [value]
+        return sum(a.nbytes for a in arrays)
+
+    def channel(self, name):
+        if self.field is None:
+            raise ValueError("Vector field not stored in this map (|B| only)")
+        return self.field[:, :, self.channels.index(name)]
 
     @property
     def gradient(self):
         if not hasattr(self, '_gradient'):
-            self._gradient = np.gradient(self.calc_absfield())
+            cache = artifacts.active()
+            if cache is None or self.key is None:
+                self._gradient = np.gradient(self.calc_absfield())
+            else:
+                key = artifacts.key('LocalField.gradient', {'field': self.key, 'channels': self.channels},
+                                    artifacts.codeVersion(__file__))
+                arrays = cache.cached(key, lambda: dict(zip(('dr', 'dz'), np.gradient(self.calc_absfield()))))
+                self._gradient = (arrays['dr'], arrays['dz'])
             return self._gradient
         else:
             return self._gradient
         
+    @property
+    def field_gradient(self):
+        """
+        Gradients of the field components on the grid (per grid step):
+        dBr/dr, dBr/dz, dBz/dr, dBz/dz
+        """
+        if not hasattr(self, '_field_gradient'):
+            self._field_gradient = np.gradient(self.channel('Bx')) + np.gradient(self.channel('Bz'))
+            return self._field_gradient
+        else:
+            return self._field_gradient
+        
     def neighbor_add(self, other):
         # other: another LocalField object
         rows, cols, chann = self.field.shape # r-axis, z-axis, B-Field channels 
-        newField = np.zeros([rows, cols + (cols - 1) / 2, chann])
+        newField = np.zeros([rows, cols + (cols - 1) // 2, chann])
         newField[:, :cols, :] = self.field
-        newField[:, (cols - 1)/2:, :] += other.field
-        return LocalField(newField, origin = self.origin, resolution = self.resolution)
+        newField[:, (cols - 1) // 2:, :] += other.field
+        return LocalField(newField, origin = self.origin, resolution = self.resolution, channels = self.channels)
 
     def calc_absfield(self):
         # sqrt(Bx^2 + By^2 + Bz^2)
+        if self.field is None:
+            return self._absfield
         absfield = np.linalg.norm(self.field, 2, axis = -1)
         return absfield
+
+    def compact(self, dropBy = 'verify', dtype = None, absOnly = False, rRange = None, tol = 1e-3):
+        """
+        Smaller copy of this map for large or many copies in memory
+        dropBy: True drops the By channel (0 by cylindrical symmetry), 'verify'
+                drops it only if |By| <= tol * max|B|, False keeps it
+        dtype: storage type, e.g. np.float32
+        absOnly: keep |B| and its gradient only, no superposition of such maps
+        rRange: (rMin, rMax) [m] radial range to keep
+        Gradients are taken before cropping so the crop edges stay accurate
+        return: compact LocalField, report of memory footprint [bytes] and the
+                largest |B| [T] and gradient [T/m] errors over the kept range
+        """
+        rows = slice(None)
+        origin = self.origin
+        if rRange is not None:
+            first = max(int(np.ceil((rRange[0] - self.origin[0]) / self.resolution - 1e-9)), 0)
+            last = min(int(np.floor((rRange[1] - self.origin[0]) / self.resolution + 1e-9)), self.shape[0] - 1)
+            if last < first:
+                raise ValueError("Empty radial range {:}".format(rRange))
+            rows = slice(first, last + 1)
+            origin = (self.origin[0] + first * self.resolution, self.origin[1])
+
+        field, channels = self.field, self.channels
+        if dropBy and 'By' in channels:
+            By = abs(self.channel('By')).max()
+            if dropBy == 'verify' and By > tol * self.calc_absfield().max():
+                print("[!] By up to {:.3g} T, above {:.0e} of the peak field, kept".format(By, tol))
+            else:
+                keep = [i for i, name in enumerate(channels) if name != 'By']
+                field, channels = field[:, :, keep], tuple(channels[i] for i in keep)
+        dtype = field.dtype if dtype is None else np.dtype(dtype)
+
+        absfield = np.linalg.norm(field if absOnly else field.astype(dtype), 2, axis = -1)
+        if absOnly:
+            compact = LocalField(None, origin, self.resolution, channels = None)
+            compact._absfield = np.ascontiguousarray(absfield[rows], dtype = dtype)
+        else:
+            compact = LocalField(np.ascontiguousarray(field[rows], dtype = dtype), origin, self.resolution, channels)
+        compact._gradient = [np.ascontiguousarray(g[rows], dtype = dtype) for g in np.gradient(absfield)]
+
+        gradient = self.gradient
+        report = {'bytes': compact.nbytes, 'originalBytes': self.nbytes,
+                  'channels': channels if not absOnly else ('absB',), 'dtype': dtype.name, 'shape': compact.shape,
+                  'fieldError': float(abs(compact.calc_absfield() - self.calc_absfield()[rows]).max()),
+                  'gradientError': float(max(abs(c - g[rows]).max() for c, g in zip(compact.gradient, gradient))
+                                         / self.resolution)}
+        return compact, report
                 
     def get_gradient(self, xyz):
         """
+        Gradient of |B| at the nearest grid point, without bounds checking
         xyz: (x, y, z)
-        return: (dB_r, dB_z)
+        return: (dB_r, dB_z) as differences per grid step [T], divide by
+                resolution for T/m (get_gradients returns T/m)
         """
         x, y, z = xyz
         r = np.sqrt(x**2 + y**2)
@@ -61,27 +164,326 @@ class LocalField:
         zIdx = np.rint((z - self.origin[1]) / self.resolution).astype(np.int32)
         return self.gradient[0][rIdx, zIdx], self.gradient[1][rIdx, zIdx]
 
+    def locate(self, r, z):
+        """
+        Fractional grid indices of positions (r, z) and the mask of
+        those inside the map
+        """
+        rows, cols = self.shape
+        fr = (np.asarray(r, dtype = float) - self.origin[0]) / self.resolution
+        fz = (np.asarray(z, dtype = float) - self.origin[1]) / self.resolution
+        inside = (fr >= 0) & (fr <= rows - 1) & (fz >= 0) & (fz <= cols - 1)
+        return fr, fz, inside
+
+    def interpolate(self, arrays, r, z, method = 'linear'):
+        """
+        Interpolate 2d arrays on the r-z grid of this map at a batch of
+        positions (r, z), method: 'linear' (bilinear) or 'cubic' (bicubic
+        convolution, clamped at the map edges)
+        return: list of interpolated values (0 outside the map), inside mask
+        """
+        fr, fz, inside = self.locate(r, z)
+        fr = np.where(inside, fr, 0)
+        fz = np.where(inside, fz, 0)
+        rows, cols = self.shape
+        i0 = np.floor(fr).astype(np.intp)
+        j0 = np.floor(fz).astype(np.intp)
+        offsets, weightsR = _interpWeights(fr - i0, method)
+        offsets, weightsZ = _interpWeights(fz - j0, method)
+
+        flats = [np.ravel(a) for a in arrays]
+        values = [np.zeros(fr.shape) for a in arrays]
+        for a, wr in zip(offsets, weightsR):
+            rowIdx = np.clip(i0 + a, 0, rows - 1) * cols
+            for b, wz in zip(offsets, weightsZ):
+                idx = rowIdx + np.clip(j0 + b, 0, cols - 1)
+                w = wr * wz
+                for value, flat in zip(values, flats):
+                    value += w * flat[idx]
+                    
+        for value in values:
+            value[~inside] = 0
+        return values, inside
+
+    def get_gradients(self, xyz, method = 'linear'):
+        """
+        Batch version of get_gradient with interpolation and bounds checking;
+        unlike get_gradient, in T/m (grid differences divided by resolution)
+        xyz: positions in shape (N, 3)
+        return: gradient of |B| in cartesian coordinates [T/m] in shape (N, 3),
+                set to 0 outside the map; mask of positions inside the map
+        """
+        x, y, z = np.asarray(xyz, dtype = float).T
+        r = np.hypot(x, y)
+        (dBr, dBz), inside = self.interpolate(self.gradient, r, z, method)
+        cos, sin = _direction(x, y, r)
+        grad = np.stack([dBr * cos, dBr * sin, dBz], axis = -1) / self.resolution
+        return grad, inside
+
+    
+    def _superpose(self, centers, r, z, weights, method, derivatives):
+        """
+        Sum of B_r, B_z (and their grid gradients) of copies of this map
+        translated along z to centers, scaled by weights
+        """
+        arrays = [self.channel('Bx'), self.channel('Bz')]
+        if derivatives:
+            arrays += list(self.field_gradient)
+        total = [np.zeros(r.shape) for a in arrays]
+        inside = np.zeros(r.shape, dtype = bool)
+        if weights is None:
+            weights = np.ones(len(centers))
+            
+        for center, weight in zip(centers, weights):
+            values, covered = self.interpolate(arrays, r, z - center, method)
+            for t, value in zip(total, values):
+                t += weight * value
+            inside |= covered
+        return total, inside
+
+    def superpose_field(self, centers, xyz, weights = None, method = 'linear'):
+        """
+        Field of copies of this map translated along z to centers and 
+        scaled by weights (current ratio and sign, default 1)
+        xyz: positions in shape (N, 3)
+        return: B in cartesian coordinates [T] in shape (N, 3), mask of 
+                positions inside any of the translated maps
+        """
+        x, y, z = np.asarray(xyz, dtype = float).T
+        r = np.hypot(x, y)
+        (Br, Bz), inside = self._superpose(centers, r, z, weights, method, False)
+        cos, sin = _direction(x, y, r)
+        return np.stack([Br * cos, Br * sin, Bz], axis = -1), inside
+
+    def superpose_gradient(self, centers, xyz, weights = None, method = 'linear'):
+        """
+        Gradient of |B| of copies of this map translated along z to centers 
+        and scaled by weights (current ratio and sign, default 1); the 
+        copies add up as vectors before taking the magnitude
+        xyz: positions in shape (N, 3)
+        return: gradient of |B| in cartesian coordinates [T/m] in shape (N, 3),
+                |B| [T], mask of positions inside any of the translated maps
+        """
+        x, y, z = np.asarray(xyz, dtype = float).T
+        r = np.hypot(x, y)
+        values, inside = self._superpose(centers, r, z, weights, method, True)
+        grad, absB = _absGradient(x, y, r, values, self.resolution)
+        return grad, absB, inside
+
+    
+def _absGradient(x, y, r, values, resolution):
+    """
+    Cartesian gradient of |B| [T/m] and |B| from summed B_r, B_z and their 
+    grid gradients
+    """
+    Br, Bz, dBrdr, dBrdz, dBzdr, dBzdz = values
+    absB = np.hypot(Br, Bz)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        dr = np.where(absB > 0, (Br * dBrdr + Bz * dBzdr) / absB, 0) / resolution
+        dz = np.where(absB > 0, (Br * dBrdz + Bz * dBzdz) / absB, 0) / resolution
+    cos, sin = _direction(x, y, r)
+    return np.stack([dr * cos, dr * sin, dz], axis = -1), absB
+
+    
+def _direction(x, y, r):
+    """
+    Cosine and sine of the azimuth, 0 on the axis
+    """
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return np.where(r > 0, x / r, 0), np.where(r > 0, y / r, 0)
+
+    
+def _interpWeights(t, method):
+    """
+    Grid offsets and weights of 1d linear or cubic convolution (Keys, a = -0.5)
+    interpolation at fractional distance t from the lower node
+    """
+    if method == 'linear':
+        return (0, 1), (1 - t, t)
+    elif method == 'cubic':
+        t2, t3 = t**2, t**3
+        return (-1, 0, 1, 2), ((-t3 + 2 * t2 - t) / 2,
+                               (3 * t3 - 5 * t2 + 2) / 2,
+                               (-3 * t3 + 4 * t2 + t) / 2,
+                               (t3 - t2) / 2)
+    else:
+        raise ValueError("Unknown interpolation method: {:}".format(method))
+
+    
+class TiledField:
+    """
+    Field of the whole slower as copies of one single trap tile (a LocalField
+    centered at z = 0) translated to the trap centers and scaled by the trap
+    current signs; queries only touch the tiles overlapping each position
+    offsets: trap centers [m], e.g. Slower.trapCenter
+    signs: per trap current scale, default 1
+    """
+    def __init__(self, tile, offsets, signs = None):
+        self.tile = tile
+        self._order = np.argsort(offsets, kind = 'stable') # traps sorted by center, weights follow the caller's order
+        self.offsets = np.asarray(offsets, dtype = float)[self._order]
+        self.signs = np.ones(self.offsets.size) if signs is None else np.asarray(signs, dtype = float)[self._order]
+        self.resolution = tile.resolution
+        self.zLow = tile.origin[1]                                   # tile z extent around its center
+        self.zHigh = tile.origin[1] + (tile.shape[1] - 1) * tile.resolution
+
+    def overlapping(self, z):
+        """
+        Range [first, last) of the (sorted) traps whose tile covers z
+        """
+        first = np.searchsorted(self.offsets, np.asarray(z) - self.zHigh, side = 'left')
+        last = np.searchsorted(self.offsets, np.asarray(z) - self.zLow, side = 'right')
+        return first, last
+
+    def _sum(self, r, z, weights, method, derivatives):
+        """
+        Sum of B_r, B_z (and their grid gradients) over the tiles overlapping
+        each position, one pass per overlap depth
+        """
+        tile = self.tile
+        arrays = [tile.channel('Bx'), tile.channel('Bz')]
+        if derivatives:
+            arrays += list(tile.field_gradient)
+        weights = self.signs if weights is None else np.asarray(weights, dtype = float)[self._order]
+        first, last = self.overlapping(z)
+        total = [np.zeros(r.shape) for a in arrays]
+        inside = np.zeros(r.shape, dtype = bool)
+        
+        for k in range(int((last - first).max(initial = 0))):
+            idx = first + k
+            valid = idx < last
+            idx = np.where(valid, idx, 0)
+            values, covered = tile.interpolate(arrays, r, z - self.offsets[idx], method)
+            w = np.where(valid, weights[idx], 0)
+            for t, value in zip(total, values):
+                t += w * value
+            inside |= covered & valid
+        return total, inside
+
+    def field(self, xyz, weights = None, method = 'linear'):
+        """
+        xyz: positions in shape (N, 3)
+        weights: per trap current scale overriding the signs (e.g. 0 for traps off),
+                 in the order of offsets
+        return: B in cartesian coordinates [T] in shape (N, 3), mask of 
+                positions inside any tile
+        """
+        x, y, z = np.asarray(xyz, dtype = float).T
+        r = np.hypot(x, y)
+        (Br, Bz), inside = self._sum(r, z, weights, method, False)
+        cos, sin = _direction(x, y, r)
+        return np.stack([Br * cos, Br * sin, Bz], axis = -1), inside
+
+    def gradient(self, xyz, weights = None, method = 'linear'):
+        """
+        return: gradient of |B| in cartesian coordinates [T/m] in shape (N, 3),
+                |B| [T], mask of positions inside any tile
+        """
+        x, y, z = np.asarray(xyz, dtype = float).T
+        r = np.hypot(x, y)
+        values, inside = self._sum(r, z, weights, method, True)
+        grad, absB = _absGradient(x, y, r, values, self.resolution)
+        return grad, absB, inside
+
+    def snapshot(self, zRange = None, weights = None):
+        """
+        Dense LocalField (channels Bx, Bz) of the static field over zRange
+        (default the whole slower) on the tile grid spacing
+        """
+        if zRange is None:
+            zRange = (self.offsets[0] + self.zLow, self.offsets[-1] + self.zHigh)
+        rows = self.tile.shape[0]
+        cols = int(np.floor((zRange[1] - zRange[0]) / self.resolution + 1e-9)) + 1
+        r = self.tile.origin[0] + np.arange(rows) * self.resolution
+        z = zRange[0] + np.arange(cols) * self.resolution
+        R, Z = np.meshgrid(r, z, indexing = 'ij')
+        (Br, Bz), inside = self._sum(R.ravel(), Z.ravel(), weights, 'linear', False)
+        field = np.stack([Br, Bz], axis = -1).reshape(rows, cols, 2)
+        return LocalField(field, origin = (r[0], zRange[0]), resolution = self.resolution, channels = ('Bx', 'Bz'))
+
     
 class MagField:
     """
     Magnetic field data loading and caching class 
     handles field symmetry 
     """
-    def __init__(self, resolution = None, source_file = None, current = -1):
+    def __init__(self, resolution = None, source_file = None, current = -1, cache_dir = None, engine = 'numpy'):
         self.source_file = source_file  # souce file for saved 2d field data
         self.resolution = resolution
         if current < 0:
             print("[!] Current cannot set to  negative !")
         self.current = current
+        self.cache_dir = cache_dir # directory for the persistent binary cache, disabled if None
+        self.engine = engine       # csv parser, 'numpy' or 'pandas' (faster on huge maps, slow to import)
                 
     def load(self):
+        """
+        Read the source file into a dict of column arrays: x, y, z, Bx, By, Bz
+        """
         if not os.path.exists(self.source_file):
             print("[!] Provided file not found !")
             return None
         
         print("[*] Loading magnetic field data ...")
-        data = pd.read_csv(self.source_file)
-        return data
+        if self.engine == 'pandas':
+            import pandas as pd
+            data = pd.read_csv(self.source_file)
+            return {column: data[column].to_numpy() for column in data.columns}
+        
+        with open(self.source_file) as f:
+            columns = [c.strip() for c in f.readline().split(',')]
+        values = np.loadtxt(self.source_file, delimiter = ',', skiprows = 1, ndmin = 2)
+        return dict(zip(columns, values.T))
+
+    def digest(self):
+        """
+        Key of the binary cache: hash of the source file content and the resolution
+        """
+        sha = hashlib.sha1()
+        with open(self.source_file, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+        sha.update(repr(float(self.resolution)).encode())
+        return sha.hexdigest()
+
+    def _cache_files(self):
+        name = os.path.join(self.cache_dir, 'field_' + self.digest())
+        return name + '.npy', name + '.json'
+
+    def load_cache(self):
+        """
+        Memory map the binary cache of the field grid if there is one,
+        return None otherwise
+        """
+        if self.cache_dir is None or not os.path.exists(self.source_file):
+            return None
+        
+        gridFile, metaFile = self._cache_files()
+        if not (os.path.exists(gridFile) and os.path.exists(metaFile)):
+            return None
+        
+        print("[*] Loading magnetic field cache {:} ...".format(gridFile))
+        with open(metaFile) as f:
+            meta = json.load(f)
+        self.leftBound, self.rightBound = meta['leftBound'], meta['rightBound']
+        return np.load(gridFile, mmap_mode = 'r')
+
+    def save_cache(self, cache):
+        """
+        Atomically write the field grid to the binary cache, concurrent 
+        workers see either no cache or a complete one
+        """
+        os.makedirs(self.cache_dir, exist_ok = True)
+        gridFile, metaFile = self._cache_files()
+        meta = {'source_file': os.path.abspath(self.source_file), 'resolution': self.resolution,
+                'leftBound': float(self.leftBound), 'rightBound': float(self.rightBound)}
+        
+        for target, write in [(metaFile, lambda f: f.write(json.dumps(meta).encode())),
+                              (gridFile, lambda f: np.save(f, cache))]: # grid last, it marks a complete cache 
+            fd, tmp = tempfile.mkstemp(dir = self.cache_dir, suffix = '.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp, target)
 
     @property
     def cache(self):
@@ -90,44 +492,80 @@ class MagField:
         Channels are: Bx, By(=0), Bz
         """
         if not hasattr(self, '_cache'):
-            data = self.load()
-            
-            if data is None:
-                print("[!] Cannot build cache Magnetic field data not loaded !")
-                return None
-            
-            print("[*] Caching magnetic field data ...")
+            cache = self.load_cache()
+            if cache is not None:
+                self._cache = cache
+                return self._cache
 
-            if data.z.unique().size % 2 == 0: # make sure there are odd number of z coords, otherwise drop last one
-                print("[#] Found even number of field mesh along z, forcing symmetric...")
-                data.drop(data.z.idxmax(), inplace = True) # double check this line 
-                assert(data.z.unique().size %2 == 1)
+            store = artifacts.active()
+            if store is None or not os.path.exists(self.source_file):
+                cache = self.build_cache()
+            else:
+                key = artifacts.key('MagField.cache', {'source': self.digest()}, artifacts.codeVersion(__file__))
+                arrays = store.cached(key, self._cache_arrays)
+                cache = None if arrays is None else arrays['cache']
+                if cache is not None:
+                    self.leftBound, self.rightBound = arrays['bounds']
+            if cache is None:
+                return None
             
-            self.leftBound = data.z.min()
-            self.rightBound = data.z.max()
-
-            zs, rs = data.z.unique().size, data.x.unique().size
-            cache = np.zeros([rs, zs, 3])  # Wow, this is like RGB image, channels are Bx, By, Bz
-
-            rMin = data.x.min()
-            zMin = data.z.min()
-            assert(abs(rMin) < 1e-6)
-
-            rows, cols = data.shape
-            for i in range(rows):
-                rIdx = int(np.rint((data.x[i] - rMin)/self.resolution))
-                zIdx = int(np.rint((data.z[i] - zMin)/self.resolution))
-                field = [data.Bx[i], data.By[i], data.Bz[i]] # may consider set By to 0
-                cache[rIdx, zIdx, :] = field
-                
             self._cache = cache
+            if self.cache_dir is not None:
+                self.save_cache(cache)
             return self._cache
         else:
             return self._cache
+
+    def _cache_arrays(self):
+        cache = self.build_cache()
+        if cache is None:
+            return None
+        return {'cache': cache, 'bounds': np.array([self.leftBound, self.rightBound])}
+
+    def build_cache(self):
+        """
+        Scatter the source columns onto the [r, z, 3] grid and set the z
+        bounds, None if the source is not loaded
+        """
+        data = self.load()
+        
+        if data is None:
+            print("[!] Cannot build cache Magnetic field data not loaded !")
+            return None
+            
+        print("[*] Caching magnetic field data ...")
+        x, z = data['x'], data['z']
+        field = np.column_stack([data['Bx'], data['By'], data['Bz']]) # may consider set By to 0
+
+        if np.unique(z).size % 2 == 0: # make sure there are odd number of z coords, otherwise drop last one
+            print("[#] Found even number of field mesh along z, forcing symmetric...")
+            keep = z < z.max()
+            x, z, field = x[keep], z[keep], field[keep]
+            assert(np.unique(z).size %2 == 1)
+            
+        self.leftBound = z.min()
+        self.rightBound = z.max()
+
+        zs, rs = np.unique(z).size, np.unique(x).size
+        cache = np.zeros([rs, zs, 3])  # Wow, this is like RGB image, channels are Bx, By, Bz
+
+        rMin = x.min()
+        zMin = z.min()
+        assert(abs(rMin) < 1e-6)
+
+        rIdx = np.rint((x - rMin)/self.resolution).astype(np.intp)
+        zIdx = np.rint((z - zMin)/self.resolution).astype(np.intp)
+        cache[rIdx, zIdx, :] = field
+        return cache
     
         
+instrument.register('magfield', globals())
+
 if __name__ == '__main__':
     mf = MagField(resolution = 5e-4, source_file = './x_y_z_Bx_By_Bz.csv', current = 400)
     field = LocalField(mf.cache, origin = (0, 0), resolution = mf.resolution)
     print(field.get_gradient((0,0,0)))
+    compact, report = field.compact(dtype = np.float32)
+    print("[*] Compact map: {:d} of {:d} bytes, |B| error {:.2e} T".format(
+        report['bytes'], report['originalBytes'], report['fieldError']))
     
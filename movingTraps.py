@@ -5,8 +5,9 @@ Created on Fri Oct 13 13:53:06 2017
 @author: Yu Lu
 """
 import numpy as np
-import matplotlib.pyplot as plt 
-import matplotlib as mpl
+import instrument
+import artifacts
+from functions import trapDepth
 # Constants needed 
 u0 = 4 * np.pi * 1e-7
 mj = 0.5
@@ -15,6 +16,40 @@ ub = 9.274e-24 # [J/T]
 M = 1.66e-27 * 7 # [Kg] Litium mass        
 
 
+def onAxisField(z, centers, current, windings, blockSize = 2**22):
+    """
+    Lab frame on-axis magnetic field of a set of traps, summed over every
+    winding in one broadcast
+    z: lab frame positions, shape (traps, z)
+    centers: trap centers, shape (traps,)
+    windings: (position, radius, current sign) of each winding measured
+              from the trap center, see slower.windings
+    return: B in shape (traps, z)
+    """
+    z = np.asarray(z, dtype = float)
+    centers = np.asarray(centers, dtype = float)
+    pos, radius, sign = windings
+    coef = u0 * current * sign * radius**2 / 2
+    
+    B = np.empty(z.shape)
+    step = max(1, blockSize // (z.shape[1] * pos.size)) # traps per block, bounds the broadcast memory 
+    for i in range(0, z.shape[0], step):
+        dz = z[i:i + step, :, None] - (centers[i:i + step, None, None] + pos)
+        B[i:i + step] = (coef / (dz**2 + radius**2)**1.5).sum(axis = -1)
+    return B
+
+
+def effectiveField(z, B, acc):
+    """
+    Effective field in the co-moving frame of each trap, the deceleration
+    acts as a linear potential referenced to the field minimum
+    z, B: shape (traps, z); acc: shape (traps,)
+    """
+    rows = np.arange(B.shape[0])
+    z0 = z[rows, np.argmin(abs(B), axis = 1)]
+    return abs(B) + M * acc[:, None] * (z - z0[:, None]) / (ub * mj * gj)
+
+
 class slower:
     
     ###########
@@ -42,6 +77,11 @@ class slower:
     stage1Length = divTrapNum * trapSpace
     stage2Length = (numTraps - divTrapNum) * trapSpace
     middlePos = trapSpace * (divTrapNum - 1)
+
+    ## SHARED TIMING SCHEDULES
+    ##########################
+    _schedules = {} # (initialV, finalV, accRatio) -> (tOn, tPeriod) of all traps
+    maxSchedules = 1024
     
     def __init__(self, initialV, finalV, accRatio, current):
         """
@@ -104,20 +144,45 @@ class slower:
             v = np.sqrt(self.middleV**2 + 2 * self.stage2Acc * (pos - self.middlePos))
         return v
 
+    def trapVelocities(self, trapNums):
+        """
+        Vectorized calcTrapVelocity for an array of trap numbers
+        """
+        trapNums = np.asarray(trapNums)
+        pos = self.trapSpace * (trapNums - 1)
+        stage1 = trapNums <= self.divTrapNum
+        v = np.empty(trapNums.shape)
+        v[stage1] = np.sqrt(self.initialV**2 + 2 * self.stage1Acc * pos[stage1])
+        v[~stage1] = np.sqrt(self.middleV**2 + 2 * self.stage2Acc * (pos[~stage1] - self.middlePos))
+        return v
+
+    def trapSchedule(self):
+        """
+        Turn on time and pulse length of every trap (1 ... numTraps) in one 
+        cumulative pass, each trap turns on half a period of the previous 
+        trap later; the read-only arrays are indexed by trapNum - 1 and shared
+        between instances of the same dynamics settings
+        return: tOn, tPeriod
+        """
+        key = (self.initialV, self.finalV, self.accRatio)
+        if key not in self._schedules:
+            with np.errstate(invalid = 'ignore'): # traps the schedule never reaches are nan, as trap by trap
+                tPeriod = 2 * self.trapSpace / 2 / self.trapVelocities(np.arange(1, self.numTraps + 1))
+                tOn = np.cumsum(np.concatenate([[-0.5 * tPeriod[0]], 0.5 * tPeriod[:-1]]))
+            tOn.setflags(write = False)
+            tPeriod.setflags(write = False)
+            if len(self._schedules) >= self.maxSchedules: # drop the oldest, keeps sweeps bounded
+                self._schedules.pop(next(iter(self._schedules)))
+            self._schedules[key] = (tOn, tPeriod)
+        return self._schedules[key]
+
     def calcTrapOnTime(self, trapNum):
         """
         Find trap turn on time and pulse length
         assumes trap at maximium depth when particle arrives at the center
         """
-        
-        if trapNum == 1:
-            tPeriod = 2 * self.trapSpace / 2 / self.calcTrapVelocity(trapNum)
-            tOn = -0.5 * tPeriod
-        else:
-            tOn_pre, tPeriod_pre = self.calcTrapOnTime(trapNum - 1)
-            tOn = tOn_pre + 0.5 * tPeriod_pre
-            tPeriod = 2 * self.trapSpace / 2 / self.calcTrapVelocity(trapNum)
-        return tOn, tPeriod
+        tOn, tPeriod = self.trapSchedule()
+        return tOn[trapNum - 1], tPeriod[trapNum - 1]
             
 
     def calcTrapAcc(self, trapNum):
@@ -127,6 +192,116 @@ class slower:
         
         acc = self.stage1Acc if trapNum <= self.divTrapNum else self.stage2Acc
         return acc
+
+    @classmethod
+    def windings(cls):
+        """
+        Geometry of every single winding of a trap measured from the trap center,
+        return: (position, radius, current sign) arrays
+        """
+        pos, radius, sign = [], [], []
+        for centerPos, layers, turns, s in zip( # for front and back coil 
+                [cls.coilSpace / 2, -cls.coilSpace / 2], 
+                [cls.numLayersFront, cls.numLayersBack], 
+                [cls.numTurnsPerLayerFront, cls.numTurnsPerLayerBack],
+                [1, -1]):
+            l, t = np.meshgrid(np.arange(layers), np.arange(turns), indexing = 'ij')
+            radius.append(cls.coilRadius + (l.ravel() + 0.5) * cls.wireDia) # radius for specific layer
+            pos.append(centerPos - (turns / 2  + 0.5) * cls.wireDia + t.ravel() * cls.wireDia)
+            sign.append(np.full(l.size, s))
+        return np.concatenate(pos), np.concatenate(radius), np.concatenate(sign)
+
+    def trapsOnAxisMagField(self, trapNums = None, z = None, table = None):
+        """
+        Calculate the on-axis magnetic field of a set of traps (default all)
+        z: shared lab frame grid, or one row per trap; default to the window 
+           +/- 2 coilSpace around each trap center as in singleTrap.onAxisMagField
+        table: fieldtable.TrapFieldTable, interpolate the shifted single trap 
+               profile instead of summing over all windings
+        return: z, B, B_eff in shape (traps, z), lab frame and co-moving frame
+        """
+        if trapNums is None:
+            trapNums = np.arange(1, self.numTraps + 1)
+        trapNums = np.atleast_1d(trapNums)
+        centers = self.trapSpace * (trapNums - 1)
+        
+        if z is None or len(z) == 0:
+            z = np.linspace(-self.coilSpace*2, self.coilSpace * 2, 100) + centers[:, None]
+        else:
+            z = np.asarray(z, dtype = float)
+            z = np.broadcast_to(z, (trapNums.size, z.shape[-1]))
+
+        acc = np.where(trapNums <= self.divTrapNum, self.stage1Acc, self.stage2Acc)
+        cache = artifacts.active()
+        if table is not None:
+            B = table.onAxis(z, centers, self.current)
+        elif cache is None:
+            B = onAxisField(z, centers, self.current, self.windings())
+        else:
+            params = {'z': z, 'centers': centers, 'current': self.current, 'windings': list(self.windings())}
+            key = artifacts.key('slower.trapsOnAxisMagField', params, artifacts.codeVersion(__file__))
+            B = cache.cached(key, lambda: {'B': onAxisField(z, centers, self.current, self.windings())})['B']
+        B_eff = effectiveField(z, B, acc)
+        return z, B, B_eff
+        
+    @classmethod
+    def trapsFieldCenter(cls, z, B, centers):
+        """
+        Vectorized field center search for rows of z, B in shape (traps, z):
+        the minimum |B| between the back and front coil of each trap
+        return: index of the field center in each row
+        """
+        centers = np.asarray(centers, dtype = float)[:, None]
+        idxFront = np.argmin(abs(z - (centers + cls.coilSpace / 2)), axis = 1)
+        idxBack = np.argmin(abs(z - (centers - cls.coilSpace / 2)), axis = 1)
+        cols = np.arange(z.shape[1])
+        window = (cols >= idxBack[:, None]) & (cols < idxFront[:, None])
+        return np.argmin(np.where(window, abs(B), np.inf), axis = 1)
+
+    @classmethod
+    def trapsFieldPeak(cls, z, B, centers):
+        """
+        Vectorized front and back peak search for rows of z, B in shape (traps, z):
+        the front peak is the maximum in front of the field center, the back
+        peak is the nearest flat point (local minimum of |dB|) behind it, 0 if none
+        return: frontPeak, backPeak
+        """
+        rows = np.arange(z.shape[0])
+        cols = np.arange(z.shape[1])
+        idxCenter = cls.trapsFieldCenter(z, B, centers)
+        frontPeak = np.where(cols >= idxCenter[:, None], B, -np.inf).max(axis = 1)
+
+        diffB = abs(np.diff(B, axis = 1))
+        i = cols[1:-2]
+        flat = (diffB[:, 1:-1] < diffB[:, :-2]) & (diffB[:, 1:-1] < diffB[:, 2:]) & (i <= idxCenter[:, None] - 1)
+        idxBack = np.where(flat, i, 0).max(axis = 1)
+        backPeak = np.where(flat.any(axis = 1), B[rows, idxBack], 0)
+        return frontPeak, backPeak
+
+    def trapDepthTable(self, trapNums = None, z = None, table = None):
+        """
+        Field center, peaks and depth of a set of traps (default all) in one 
+        vectorized pass, see trapsOnAxisMagField for z and table 
+        return: dict of per trap arrays, trapNum, trapCenter [m], fieldCenter [m],
+                frontPeak, backPeak [T] in the co-moving frame, depth [mK] in 
+                the lab frame, comovingDepth [mK]
+        """
+        if trapNums is None:
+            trapNums = np.arange(1, self.numTraps + 1)
+        trapNums = np.atleast_1d(trapNums)
+        centers = self.trapSpace * (trapNums - 1)
+        z, B, B_eff = self.trapsOnAxisMagField(trapNums, z, table)
+
+        fieldCenter = z[np.arange(z.shape[0]), self.trapsFieldCenter(z, B, centers)]
+        frontPeak, backPeak = self.trapsFieldPeak(z, B_eff, centers)
+        labPeaks = self.trapsFieldPeak(z, abs(B), centers)
+        return {'trapNum': trapNums,
+                'trapCenter': centers,
+                'fieldCenter': fieldCenter,
+                'frontPeak': frontPeak,
+                'backPeak': backPeak,
+                'depth': trapDepth(np.minimum(*labPeaks)) * 1e3,
+                'comovingDepth': trapDepth(np.minimum(frontPeak, backPeak)) * 1e3}
         
     def effectiveOnAxisMagField(self, curr, z):
         """
@@ -150,35 +325,14 @@ class singleTrap(slower):
         self.trapAcc = self.calcTrapAcc(trapNum)
         
         
-    def onAxisMagField(self, z = []):
+    def onAxisMagField(self, z = None):
         """
         Calculate the magnetic field generated from the anti-helmholtz coil
         under current "curr" at position z (from the trap center), in the 
         labtory frame
         """
-        if z ==[]:
-            z = np.linspace(-self.coilSpace*2, self.coilSpace * 2, 100) + self.trapCenter
-        else:
-            pass
-        
-        frontCoilCenter = self.coilSpace / 2 + self.trapCenter
-        backCoilCenter = -self.coilSpace / 2 + self.trapCenter
-        B = 0
-        
-        for centerPos, layers, turns in zip( # for front and back coil 
-                [frontCoilCenter, backCoilCenter], 
-                [self.numLayersFront, self.numLayersBack], 
-                [self.numTurnsPerLayerFront, self.numTurnsPerLayerBack]):
-            
-            for l in range(layers):
-                layerRadius = self.coilRadius + (l + 0.5) * self.wireDia # radius for specific layre 
-                for t in range(turns):
-                    windingCenter = centerPos - (turns / 2  + 0.5) * self.wireDia + t * self.wireDia # center position for single winding
-                    current = self.current if centerPos > self.trapCenter else -self.current
-                    B += u0 * current * layerRadius**2 / 2 / (((z - windingCenter)**2 + layerRadius**2)**1.5)
-        B_eff = abs(B) + M * self.trapAcc * (z - z[np.argmin(abs(B))])/ (ub * mj * gj)
-        
-        return z,B,B_eff
+        z, B, B_eff = self.trapsOnAxisMagField([self.trapNum], z)
+        return z[0], B[0], B_eff[0]
 
 
     def trapFieldCenter(self, z, B):
@@ -186,35 +340,16 @@ class singleTrap(slower):
         Find the magnetic field center (0 field) and return corresponding 
         position 
         """
-        frontCoilCenter = self.coilSpace / 2 + self.trapCenter
-        backCoilCenter = -self.coilSpace / 2 + self.trapCenter
-        idxFrontCenter = np.argmin(abs(z - frontCoilCenter))
-        idxBackCenter = np.argmin(abs(z - backCoilCenter))
-        
-        idxFieldCenter = np.argmin(abs(B[idxBackCenter: idxFrontCenter])) + idxBackCenter
-        return z[idxFieldCenter]
+        idx = self.trapsFieldCenter(z[None, :], B[None, :], [self.trapCenter])
+        return z[idx[0]]
         
         
     def fieldPeak(self, z, B):
         """ 
         Find front and back peak of the magnetic field potential
         """
-        fieldCenter = self.trapFieldCenter(z, B)
-        idxFieldCenter = np.argmin(abs(z - fieldCenter))
-        
-        frontPeak = max(B[idxFieldCenter:])
-        frontPeakIdx = np.argmax(B[idxFieldCenter:])
-        backPeak = 0
-        backPeakIdx = 0
-        diffB = abs(np.diff(B))       
-        for i in range(idxFieldCenter - 1, 0, -1):
-            if diffB[i] < diffB[i - 1] and diffB[i] < diffB[i+1]:
-                backPeak = B[i]
-                backPeakIdx = i
-                break        
-        z0 = z[frontPeakIdx] if frontPeak <= backPeak else z[backPeakIdx]
-            
-        return frontPeak, backPeak
+        frontPeak, backPeak = self.trapsFieldPeak(z[None, :], B[None, :], [self.trapCenter])
+        return frontPeak[0], backPeak[0]
         
                 
     def plotField1D(self, pos, B, B_eff):
@@ -228,6 +363,9 @@ class singleTrap(slower):
             print("position and field has different length: ({:2d}, {:2d})".format(len(pos), len(B)))
 
         else:
+            import matplotlib.pyplot as plt # plotting only, keeps the module import light
+            import matplotlib as mpl
+            
             fig, ax = plt.subplots()
             ax.plot(pos*1e3, abs(B), '*', label = 'lab frame')
             ax.plot(pos*1e3, B_eff, 'r--', label = 'co-moving frame')
@@ -240,6 +378,6 @@ class singleTrap(slower):
 
             ax.grid(which = 'both')
             plt.show()
-    
 
-    
+
+instrument.register('movingTraps', globals())
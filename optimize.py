@@ -0,0 +1,302 @@
+# optimize.py ---
+#
+# Filename: optimize.py
+# Description:
+#            Search of the two stage schedule (accRatio, divTrapIdx)
+#          and the coil current maximizing the minimum co-moving trap
+#          depth or the captured fraction; candidates are evaluated in
+#          batches (vectorized for the depth, across a process pool for
+#          the captured fraction, where candidates clearly worse than the
+#          best are stopped after a pilot run) and the objective values
+#          are memoized, on disk with an output csv
+# Author:    Yu Lu
+# Email:     yulu@utexas.edu
+# Github:    https://github.com/SuperYuLu
+#
+# Usage:
+#     python3 optimize.py                     (settings.optimizeObjective, settings.optimizeBounds,
+#                                              values kept in settings.optimizeOutput)
+#
+
+import os
+import csv
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import settings
+import artifacts
+from slower import Slower
+from movingTraps import slower, onAxisField, effectiveField
+from functions import trapDepth
+from sweep import PARAMETERS, defaults, pointKey
+
+
+SEARCHED = ('accRatio', 'divTrapIdx', 'current')
+
+
+def schedule(point):
+    """
+    Slower of a parameter point, None if the two stages cannot both decelerate
+    """
+    with np.errstate(invalid = 'ignore'):
+        s = Slower(point['initialV'], point['finalV'], point['accRatio'], divTrapIdx = int(point['divTrapIdx']))
+    if np.isfinite(s.middleV) and s.stage1Acc < 0 and s.stage2Acc < 0:
+        return s
+    return None
+
+
+def comovingDepth(points):
+    """
+    Minimum co-moving trap depth [mK] of the two stages of each point, all
+    points in one batch: the field scales with the current, so one unit
+    current profile serves every candidate and only the two stage
+    accelerations differ; nan for infeasible schedules
+    """
+    z = np.linspace(-slower.coilSpace * 2, slower.coilSpace * 2, 100) # same window as sweep.evaluateSchedule
+    B1 = onAxisField(z[None, :], [0.], 1, slower.windings())[0]
+
+    current = np.array([p['current'] for p in points], dtype = float)
+    stages = [schedule(p) for p in points]
+    feasible = np.array([s is not None for s in stages])
+    acc = np.array([[s.stage1Acc, s.stage2Acc] if s is not None else [0., 0.] for s in stages]).ravel()
+
+    rows = 2 * len(points)
+    zRows = np.broadcast_to(z, (rows, z.size))
+    B = np.repeat(current, 2)[:, None] * B1
+    frontPeak, backPeak = slower.trapsFieldPeak(zRows, effectiveField(zRows, B, acc), np.zeros(rows))
+    depth = (trapDepth(np.minimum(frontPeak, backPeak)) * 1e3).reshape(-1, 2).min(axis = 1)
+    return np.where(feasible, depth, np.nan)
+
+
+_worker = {} # single trap field map of the pool workers
+
+
+def _initWorker(localField):
+    _worker['localField'] = localField
+
+
+def _simulator(point, localField, mapCurrent, simulatorOptions):
+    from simulator import Simulator
+    from waveforms import EnvelopeTable, Waveform
+    s = schedule(point)
+    sim = Simulator(s, localField, **simulatorOptions)
+    sim.envelope = EnvelopeTable(s, Waveform(), sim.dt, amplitude = point['current'] / mapCurrent)
+    return sim
+
+
+def _captureBlocks(point, blocks, nAtoms, seed, mapCurrent, simulatorOptions):
+    """
+    Captured and simulated atoms of some blocks of the run of a point, the
+    blocks being those of a full Simulator.run
+    """
+    sim = _simulator(point, _worker['localField'], mapCurrent, simulatorOptions)
+    beam, bins = sim.defaults()
+    entropy = np.random.SeedSequence(seed).entropy
+    results = [sim.runBlock(block, nAtoms, beam, entropy, bins) for block in blocks]
+    return sum(r.numCaptured for r in results), sum(r.numAtoms for r in results)
+
+
+class Optimizer:
+    """
+    Batched random search in a box shrinking around the best point, over
+    accRatio, divTrapIdx (rounded) and current; other parameters are taken
+    from settings.py or fixed
+    objective: 'depth' (minimum co-moving trap depth, vectorized over the
+               batch) or 'captured' (captured fraction of nAtoms simulated
+               atoms, needs the single trap localField at mapCurrent)
+    pilotFraction: share of the atoms simulated first; candidates whose
+                   pilot estimate is 3 sigma below the best are stopped;
+                   without a chunkSize in simulatorOptions the chunks are
+                   sized to pilotFraction * nAtoms so the pilot is one chunk
+    workers: processes running the captured fraction candidates, default
+             the number of cpus
+    output: csv keeping the objective values across runs, by point key and
+            a hash of the objective settings (simulatorOptions json-able)
+    """
+    def __init__(self, objective = 'depth', bounds = None, fixed = None, batchSize = 32, rounds = 8, shrink = 0.6,
+                 seed = 0, localField = None, mapCurrent = 400, nAtoms = 2000, pilotFraction = 0.2,
+                 simulatorOptions = None, workers = None, output = None):
+        if objective not in ('depth', 'captured'):
+            raise ValueError("Unknown objective: {:}".format(objective))
+        if objective == 'captured' and localField is None:
+            raise ValueError("The captured fraction objective needs a localField")
+        self.objective = objective
+        self.bounds = dict(settings.optimizeBounds if bounds is None else bounds)
+        self.fixed = defaults()
+        self.fixed.update(fixed or {})
+        self.batchSize = batchSize
+        self.rounds = rounds
+        self.shrink = shrink
+        self.rng = np.random.default_rng(seed)
+        self.seed = seed
+        self.localField = localField
+        self.mapCurrent = mapCurrent
+        self.nAtoms = nAtoms
+        self.pilotFraction = pilotFraction
+        self.simulatorOptions = dict(simulatorOptions or {})
+        if objective == 'captured':
+            self.simulatorOptions.setdefault('chunkSize', max(1, int(np.ceil(nAtoms * pilotFraction))))
+        self.workers = workers
+        self.output = output
+
+        self.memo = {}       # point key -> objective value, nan for infeasible and stopped points
+        self.terminated = set()  # keys of points stopped after the pilot run
+        self.pilots = {}     # point key -> pilot estimate of the stopped points
+        self.history = []
+        self.best, self.bestValue = None, -np.inf
+        self.context = self._context()
+        self._load()
+
+    def _context(self):
+        """
+        Hash of the settings, besides the point, the objective values depend on
+        """
+        params = {'objective': self.objective}
+        files = [__file__]
+        if self.objective == 'captured':
+            import simulator, waveforms
+            lf = self.localField
+            params.update(nAtoms = self.nAtoms, seed = self.seed, pilotFraction = self.pilotFraction,
+                          mapCurrent = self.mapCurrent, simulatorOptions = self.simulatorOptions,
+                          origin = list(lf.origin), resolution = lf.resolution,
+                          field = lf.key if lf.key is not None else lf.field if lf.field is not None else lf._absfield)
+            files += [simulator.__file__, waveforms.__file__]
+        return artifacts.key('Optimizer', params, artifacts.codeVersion(*files))[:16]
+
+    def _load(self):
+        if self.output is None or not os.path.exists(self.output):
+            return
+        with open(self.output, newline = '') as f:
+            for row in csv.DictReader(f):
+                if row['context'] == self.context:
+                    self.memo[row['key']] = float(row['value'])
+                    if row['terminated'] == '1':
+                        self.terminated.add(row['key'])
+                        self.pilots[row['key']] = float(row['pilot'])
+
+    def _save(self, points, values):
+        new = not os.path.exists(self.output) or os.path.getsize(self.output) == 0
+        with open(self.output, 'a', newline = '') as f:
+            writer = csv.writer(f)
+            if new:
+                writer.writerow(['key', 'context', 'value', 'terminated', 'pilot'] + list(PARAMETERS))
+            for point, value in zip(points, values):
+                key = pointKey(point)
+                writer.writerow([key, self.context, repr(float(value)), int(key in self.terminated),
+                                 repr(self.pilots[key]) if key in self.terminated else ''] +
+                                [point[name] for name in PARAMETERS])
+
+    def point(self, values):
+        point = dict(self.fixed)
+        point.update(values)
+        point['divTrapIdx'] = int(np.clip(np.rint(point['divTrapIdx']), 1, Slower.numTraps - 2))
+        return point
+
+    def candidates(self, box):
+        points = [self.point({name: self.rng.uniform(*box[name]) for name in box}) for i in range(self.batchSize)]
+        if self.best is not None:
+            points[0] = self.best
+        return points
+
+    def _captured(self, points):
+        """
+        Captured fraction of each point, the candidates run in parallel in a
+        process pool: first the pilot blocks of every candidate, then the rest
+        for the candidates whose pilot estimate is not 3 sigma below the best
+        value so far or below the pilot lower bound of another candidate;
+        stopped candidates get nan, their pilot estimate is kept in pilots
+        """
+        values = np.full(len(points), np.nan)
+        feasible = [i for i, point in enumerate(points) if schedule(point) is not None]
+        if not feasible:
+            return values
+        numBlocks = _simulator(points[feasible[0]], self.localField, self.mapCurrent,
+                               self.simulatorOptions).numBlocks(self.nAtoms)
+        pilot = max(1, int(np.ceil(numBlocks * self.pilotFraction)))
+        if pilot >= numBlocks:
+            print("[!] Optimizer: the pilot covers all {:d} chunks of {:d} atoms, no candidate is stopped early; "
+                  "lower chunkSize".format(numBlocks, self.nAtoms))
+        args = (self.nAtoms, self.seed, self.mapCurrent, self.simulatorOptions)
+
+        with ProcessPoolExecutor(self.workers, initializer = _initWorker, initargs = (self.localField,)) as pool:
+            counts = [pool.submit(_captureBlocks, points[i], range(pilot), *args) for i in feasible]
+            counts = np.array([future.result() for future in counts], dtype = float)
+            p = counts[:, 0] / counts[:, 1]
+            sigma = 3 * np.sqrt(np.maximum(p * (1 - p), 1 / counts[:, 1]) / counts[:, 1])
+            threshold = max(self.bestValue, (p - sigma).max())
+            stopped = (p + sigma < threshold) if pilot < numBlocks else np.zeros(p.size, dtype = bool)
+
+            rest = {i: pool.submit(_captureBlocks, points[i], range(pilot, numBlocks), *args)
+                    for i, stop in zip(feasible, stopped) if not stop and pilot < numBlocks}
+            for k, i in enumerate(feasible):
+                if stopped[k]:
+                    key = pointKey(points[i])
+                    self.terminated.add(key)
+                    self.pilots[key] = float(p[k])
+                    continue
+                if i in rest:
+                    counts[k] += rest[i].result()
+                values[i] = counts[k, 0] / counts[k, 1]
+        return values
+
+    def evaluate(self, points):
+        """
+        Objective values of a batch, from the memo where possible
+        return: values, number of memo hits
+        """
+        keys = [pointKey(p) for p in points]
+        todo = {}
+        for key, point in zip(keys, points):
+            if key not in self.memo:
+                todo[key] = point
+        if todo:
+            values = comovingDepth(list(todo.values())) if self.objective == 'depth' else self._captured(list(todo.values()))
+            self.memo.update(zip(todo, values))
+            if self.output is not None:
+                self._save(list(todo.values()), values)
+        return np.array([self.memo[key] for key in keys]), len(points) - len(todo)
+
+    def run(self):
+        """
+        return: best point, best objective value
+        """
+        box = {name: tuple(map(float, self.bounds[name])) for name in SEARCHED if name in self.bounds}
+        for i in range(self.rounds):
+            points = self.candidates(box)
+            values, hits = self.evaluate(points)
+            ranked = np.where(np.isnan(values), -np.inf, values) # infeasible and stopped points never rank
+            k = int(np.argmax(ranked))
+            if ranked[k] > self.bestValue:
+                self.best, self.bestValue = points[k], float(ranked[k])
+            self.history.append({'round': i, 'evaluated': len(points) - hits, 'memoHits': hits,
+                                 'terminated': len(self.terminated), 'roundBest': float(ranked[k]),
+                                 'best': self.bestValue, 'box': dict(box)})
+
+            if self.best is not None: # shrink the box around the best point, within the bounds
+                for name, (low, high) in box.items():
+                    half = 0.5 * (high - low) * self.shrink
+                    center = np.clip(self.best[name], *self.bounds[name])
+                    box[name] = (max(self.bounds[name][0], center - half), min(self.bounds[name][1], center + half))
+        return self.best, self.bestValue
+
+    def report(self):
+        unit = 'mK' if self.objective == 'depth' else ''
+        lines = ["{:>5} {:>9} {:>9} {:>11} {:>12} {:>12}".format('round', 'evaluated', 'memo hits', 'terminated',
+                                                                 'round best', 'best')]
+        for h in self.history:
+            lines.append("{:>5d} {:>9d} {:>9d} {:>11d} {:>12.4f} {:>12.4f}".format(
+                h['round'], h['evaluated'], h['memoHits'], h['terminated'], h['roundBest'], h['best']))
+        if self.best is not None:
+            s = schedule(self.best)
+            lines += ["Best {:}: {:.4f} {:}".format(self.objective, self.bestValue, unit),
+                      "  accRatio: {:.4f}  divTrapIdx: {:d}  current: {:.1f} A".format(
+                          self.best['accRatio'], self.best['divTrapIdx'], self.best['current']),
+                      "  stage1Acc: {:.1f}  stage2Acc: {:.1f} m/s2  middleV: {:.2f} m/s  total time: {:.3f} ms".format(
+                          s.stage1Acc, s.stage2Acc, s.middleV, s.totalTime * 1e3)]
+        return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    optimizer = Optimizer(settings.optimizeObjective, output = settings.optimizeOutput)
+    optimizer.run()
+    print(optimizer.report())
@@ -25,3 +25,17 @@ current = 400
 
 
 singleTrapRunNum = 10
+
+
+## Parameter sweep, see sweep.py
+sweepGrid = {'accRatio': [0.6, 0.8, 1, 1.2],
+             'divTrapIdx': [120, 179, 240]}
+sweepOutput = 'sweep.csv'
+
+
+## Schedule optimization, see optimize.py
+optimizeBounds = {'accRatio': (0.5, 1.5),
+                  'divTrapIdx': (60, 420),
+                  'current': (300, 500)}
+optimizeObjective = 'depth'  # or 'captured'
+optimizeOutput = 'optimize.csv'
@@ -0,0 +1,152 @@
+# sharedfield.py ---
+#
+# Filename: sharedfield.py
+# Description:
+#            Field map shared across processes: the parent builds a
+#          LocalField and its gradients once and publishes the arrays
+#          in shared memory (or read-only .npy memmaps); workers attach
+#          LocalField views on them without copying or reloading
+# Author:    Yu Lu
+# Email:     yulu@utexas.edu
+# Github:    https://github.com/SuperYuLu
+#
+# Usage:
+#     with SharedField(localField) as shared:
+#         with ProcessPoolExecutor(initializer = initWorker, initargs = (shared.spec,)) as pool:
+#             ...   # workers call workerField()
+#
+
+import os
+import shutil
+import tempfile
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+from magfield import LocalField
+
+
+def _arrays(field, derivatives):
+    """
+    Arrays of a LocalField to publish, name -> array
+    """
+    arrays = {}
+    if field.field is None:
+        arrays['absfield'] = field.calc_absfield()
+    else:
+        arrays['field'] = field.field
+    for i, g in enumerate(field.gradient):
+        arrays['gradient{:d}'.format(i)] = g
+    if derivatives:
+        for i, g in enumerate(field.field_gradient):
+            arrays['field_gradient{:d}'.format(i)] = g
+    return arrays
+
+
+class SharedField:
+    """
+    Owner of the published arrays of a LocalField, they are released on
+    close (or leaving the with block), after the workers are done
+    backend: 'shm' (multiprocessing.shared_memory) or 'memmap' (.npy files
+             in directory, a temporary one by default)
+    derivatives: also publish the field component gradients used by
+                 superposition
+    spec: picklable description of the arrays, passed to the workers
+    """
+    def __init__(self, field, backend = 'shm', derivatives = False, directory = None):
+        self.backend = backend
+        self._blocks = []
+        self._directory = None
+        arrays = {}
+        if backend == 'memmap':
+            if directory is None:
+                directory = self._directory = tempfile.mkdtemp(prefix = 'field_')
+            os.makedirs(directory, exist_ok = True)
+        elif backend != 'shm':
+            raise ValueError("Unknown backend: {:}".format(backend))
+
+        for name, array in _arrays(field, derivatives).items():
+            array = np.ascontiguousarray(array)
+            if backend == 'shm':
+                block = shared_memory.SharedMemory(create = True, size = max(array.nbytes, 1))
+                np.ndarray(array.shape, array.dtype, buffer = block.buf)[...] = array
+                self._blocks.append(block)
+                arrays[name] = {'shm': block.name, 'shape': array.shape, 'dtype': array.dtype.str}
+            else:
+                path = os.path.join(directory, name + '.npy')
+                np.save(path, array)
+                arrays[name] = {'file': path}
+
+        self.spec = {'origin': tuple(field.origin), 'resolution': field.resolution,
+                     'channels': field.channels, 'arrays': arrays}
+
+    def close(self):
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+        if self._directory is not None:
+            shutil.rmtree(self._directory, ignore_errors = True)
+            self._directory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _attachBlock(name):
+    """
+    Attach an existing block without handing it to this process' resource
+    tracker, which would otherwise unlink it when the worker exits
+    """
+    try:
+        return shared_memory.SharedMemory(name = name, track = False)
+    except TypeError: # python < 3.13, skip the registration (forked workers share the owner's tracker)
+        register = resource_tracker.register
+        resource_tracker.register = lambda *args: None
+        try:
+            return shared_memory.SharedMemory(name = name)
+        finally:
+            resource_tracker.register = register
+
+
+def attach(spec):
+    """
+    Read-only LocalField view on published arrays, nothing is copied
+    """
+    arrays, blocks = {}, []
+    for name, entry in spec['arrays'].items():
+        if 'shm' in entry:
+            block = _attachBlock(entry['shm'])
+            blocks.append(block)
+            array = np.ndarray(tuple(entry['shape']), np.dtype(entry['dtype']), buffer = block.buf)
+        else:
+            array = np.load(entry['file'], mmap_mode = 'r')
+        array.flags.writeable = False
+        arrays[name] = array
+
+    field = LocalField(arrays.get('field'), spec['origin'], spec['resolution'], spec['channels'])
+    if field.field is None:
+        field._absfield = arrays['absfield']
+    field._gradient = [arrays['gradient{:d}'.format(i)] for i in range(2)]
+    if 'field_gradient0' in arrays:
+        field._field_gradient = [arrays['field_gradient{:d}'.format(i)] for i in range(4)]
+    field._blocks = blocks # keep the mappings alive with the view
+    return field
+
+
+_worker = {}
+
+
+def initWorker(spec):
+    """
+    Process pool initializer: attach the published field once per worker
+    """
+    _worker['field'] = attach(spec)
+
+
+def workerField():
+    """
+    Field attached by initWorker in this worker
+    """
+    return _worker['field']
@@ -0,0 +1,513 @@
+# simulator.py ---
+#
+# Filename: simulator.py
+# Description:
+#            Monte Carlo simulation of atoms from a supersonic
+#          beam pushed through the moving trap slower, the whole
+#          ensemble integrated together chunk by chunk
+# Author:    Yu Lu
+# Email:     yulu@utexas.edu
+# Github:    https://github.com/SuperYuLu
+#
+
+import numpy as np
+import artifacts
+from checkpoint import Checkpointer, load as loadCheckpoint
+from slower import M, ub, gj, mj
+from functions import kb
+from accumulators import Moments, PhaseSpaceStats, LossTally
+
+
+class SupersonicBeam:
+    """
+    Initial phase space distribution of the atoms, gaussian in position
+    and velocity around the synchronous atom
+    """
+    def __init__(self, meanV, sigmaVz = 10, sigmaVr = 2, sigmaZ = 1e-3, sigmaR = 0.5e-3):
+        self.meanV = meanV      # [m/s] mean forward velocity
+        self.sigmaVz = sigmaVz  # [m/s] longitudinal velocity spread
+        self.sigmaVr = sigmaVr  # [m/s] transverse velocity spread, per axis
+        self.sigmaZ = sigmaZ    # [m] longitudinal position spread
+        self.sigmaR = sigmaR    # [m] transverse position spread, per axis
+
+    def sample(self, n, rng, z0 = 0):
+        """
+        Draw n atoms centered at z0
+        return: positions, velocities in shape (n, 3)
+        """
+        pos = rng.normal(0, 1, (n, 3)) * [self.sigmaR, self.sigmaR, self.sigmaZ]
+        vel = rng.normal(0, 1, (n, 3)) * [self.sigmaVr, self.sigmaVr, self.sigmaVz]
+        pos[:, 2] += z0
+        vel[:, 2] += self.meanV
+        return pos, vel
+
+
+class SimulationResult:
+    """
+    Reduced outcome of a simulation, accumulated chunk by chunk:
+    atom counts, final velocity histogram and velocity moments of the
+    captured atoms
+    """
+    def __init__(self, velocityBins):
+        self.velocityBins = np.asarray(velocityBins, dtype = float)
+        self.numAtoms = 0
+        self.numCaptured = 0
+        self.numLost = 0
+        self.velocityHist = np.zeros(self.velocityBins.size - 1, dtype = np.int64)
+        self.velocity = Moments((3,))
+        self.steps = 0              # integrator steps, summed over chunks
+        self.forceEvaluations = 0
+        self.fixedSteps = 0         # steps and force evaluations the fixed step integrator takes
+        self.fixedEvaluations = 0
+        self.stats = None           # accumulators.PhaseSpaceStats, if the simulator keeps them
+
+    def add(self, vel, captured, lost):
+        """
+        Accumulate the final state of one chunk
+        """
+        v = vel[captured]
+        self.numAtoms += vel.shape[0]
+        self.numCaptured += v.shape[0]
+        self.numLost += int(lost.sum())
+        self.velocityHist += np.histogram(v[:, 2], self.velocityBins)[0]
+        self.velocity.update(v)
+
+    def merge(self, other):
+        """
+        Add the result of another chunk, merging in a fixed chunk order
+        gives the same sums however the chunks were run
+        """
+        self.numAtoms += other.numAtoms
+        self.numCaptured += other.numCaptured
+        self.numLost += other.numLost
+        self.velocityHist += other.velocityHist
+        self.velocity.merge(other.velocity)
+        self.steps += other.steps
+        self.forceEvaluations += other.forceEvaluations
+        self.fixedSteps += other.fixedSteps
+        self.fixedEvaluations += other.fixedEvaluations
+        if other.stats is not None:
+            if self.stats is None:
+                self.stats = other.stats.empty()
+            self.stats.merge(other.stats)
+        return self
+
+    @property
+    def capturedFraction(self):
+        return self.numCaptured / self.numAtoms if self.numAtoms else 0.
+
+    @property
+    def meanVelocity(self):
+        return self.velocity.mean
+
+    @property
+    def temperature(self):
+        """
+        Temperature [K] of the captured atoms along x, y, z
+        """
+        return M * self.velocity.variance / kb
+
+    def __str__(self):
+        return '\n'.join([
+            "Atoms simulated: {:d}  captured: {:d} ({:.2%})  lost on coils: {:d}".format(
+                self.numAtoms, self.numCaptured, self.capturedFraction, self.numLost),
+            "Final velocity [m/s]: {:.2f} {:.2f} {:.2f}".format(*self.meanVelocity),
+            "Final temperature [mK]: {:.2f} {:.2f} {:.2f}".format(*self.temperature * 1e3),
+            "Steps: {:d}  force evaluations: {:d}  saved vs fixed step: {:d} steps, {:d} evaluations".format(
+                self.steps, self.forceEvaluations, self.fixedSteps - self.steps,
+                self.fixedEvaluations - self.forceEvaluations)])
+
+
+class Simulator:
+    """
+    Push an atom ensemble through the time dependent field of the slower,
+    low field seeking atoms feel the force -mu * grad|B|; integrated with the
+    symplectic velocity Verlet (kick-drift-kick) scheme, either at fixed time
+    step dt or, with integrator = 'adaptive', with the trap switch times as
+    hard event boundaries and the step adapted in between from the force
+    gradient seen by the atoms, dt = eta / sqrt(|da| / |dx|) in [dtMin, dtMax]
+    """
+    def __init__(self, slower, localField, dt = 1e-7, chunkSize = 100000, method = 'linear', mass = M, writer = None,
+                 integrator = 'fixed', dtMin = None, dtMax = None, eta = 0.05, quantile = 0.99, stats = None,
+                 envelope = None):
+        self.slower = slower            # slower.Slower, trap schedule
+        self.localField = localField    # single trap field map, centered at the trap center
+        self.dt = dt
+        self.chunkSize = chunkSize      # atoms integrated together, bounds the memory
+        self.method = method            # field interpolation method
+        self.mass = mass
+        self.mu = ub * gj * mj          # magnetic moment of low field seekers
+        self.rWall = localField.origin[0] + (localField.shape[0] - 1) * localField.resolution
+        self.writer = writer            # storage.ResultWriter, particle states, per chunk and per trap counts
+
+        if integrator not in ('fixed', 'adaptive'):
+            raise ValueError("Unknown integrator: {:}".format(integrator))
+        self.integrator = integrator
+        self.dtMin = dt / 10 if dtMin is None else dtMin
+        self.dtMax = dt * 10 if dtMax is None else dtMax
+        self.eta = eta                  # step size in units of the local oscillation period / 2pi
+        self.quantile = quantile        # of the atoms force gradients setting the step, robust to outliers
+        self.stats = stats              # accumulators.PhaseSpaceStats template, see phaseSpaceStats()
+        self.envelope = envelope        # waveforms.EnvelopeTable, trap currents with finite rise and fall
+        self._stats = None              # statistics of the chunk being pushed
+        self._losses = None             # LossTally of the chunk being pushed, for the writer
+        self._checkpointer = None       # Checkpointer of the running run()
+        self._context = None            # run state saved with the checkpoints
+        self.steps = 0
+        self.forceEvaluations = 0
+
+    @property
+    def startTime(self):
+        return self.slower.trapOnTime[0]
+
+    @property
+    def endTime(self):
+        """
+        Synchronous atom arrives at the last trap center
+        """
+        return self.slower.trapCenterTime[-1]
+
+    def phaseSpaceStats(self, numSamples = 100, zBins = None, vBins = None):
+        """
+        Statistics template sampled at numSamples times over the deceleration,
+        default bins of +/- one trap spacing in z and +/- 50 m/s in vz
+        """
+        s = self.slower
+        if zBins is None:
+            zBins = np.linspace(-s.trapSpace, s.trapSpace, 101)
+        if vBins is None:
+            vBins = np.linspace(-50, 50, 101)
+        return PhaseSpaceStats(np.linspace(self.startTime, self.endTime, numSamples), zBins, vBins,
+                               s.numTraps, s.trapSpace)
+
+    def trapIndex(self, z):
+        """
+        Index of the trap center nearest to z
+        """
+        centers = self.slower.trapCenter
+        return np.searchsorted(0.5 * (centers[1:] + centers[:-1]), z)
+
+    def _observe(self, k, t, pos, vel, lost, newlyLost = None):
+        """
+        Update the statistics of the chunk with the losses of the last step 
+        and the sample times reached at t, from sample index k on
+        return: next sample index
+        """
+        stats = self._stats
+        if newlyLost is not None and newlyLost.any():
+            stats.losses.update(self.trapIndex(pos[newlyLost, 2]))
+        while k < stats.times.size and stats.times[k] <= t + 1e-12:
+            zs, vs = self.slower.synchronousAtom(t)
+            dv = vel.copy()
+            dv[:, 2] -= vs
+            stats.record(k, pos[:, 2] - zs, dv, lost)
+            k += 1
+        return k
+
+    def _firstSample(self, t0, pos, vel, lost):
+        """
+        Skip the sample times before t0 and record the ones at t0
+        """
+        if self._stats is None:
+            return 0
+        return self._observe(np.searchsorted(self._stats.times, t0 - 1e-12), t0, pos, vel, lost)
+
+    def acceleration(self, t, pos, fieldTime = None):
+        """
+        fieldTime: time selecting the active traps, default t; with an envelope
+                   the currents, and so the traps, always follow t
+        """
+        self.forceEvaluations += 1
+        if self.envelope is not None: # currents change within the intervals, follow t
+            grad, absB, inside = self.slower.fieldGradient(t, pos, self.localField, self.method, self.envelope)
+        else:
+            grad, absB, inside = self.slower.fieldGradient(t if fieldTime is None else fieldTime,
+                                                           pos, self.localField, self.method)
+        return -self.mu / self.mass * grad
+
+    def push(self, pos, vel, t0, t1, atoms = None, resume = None):
+        """
+        Integrate positions and velocities in place from t0 to t1; atoms
+        reaching the coil radius are lost and stop feeling any force
+        atoms: global atom indices, for the states saved by the writer,
+               default 0 ... N - 1
+        resume: loop state of a checkpoint to continue from
+        return: mask of lost atoms
+        """
+        if atoms is None:
+            atoms = np.arange(pos.shape[0])
+        if self.integrator == 'adaptive':
+            return self._pushAdaptive(pos, vel, t0, t1, atoms, resume)
+        
+        steps = int(np.ceil((t1 - t0) / self.dt - 1e-9))
+        if resume is None:
+            lost = np.zeros(pos.shape[0], dtype = bool)
+            t = t0
+            first = 0
+            sample = self._firstSample(t0, pos, vel, lost)
+            acc = self.acceleration(t, pos)
+        else:
+            lost, t, first, sample, acc = [resume[name] for name in ('lost', 't', 'step', 'sample', 'acc')]
+        for i in range(first, steps):
+            if self._checkpointer is not None and self._checkpointer.due():
+                self._saveCheckpoint(pos, vel, lost = lost, t = t, step = i, sample = sample, acc = acc)
+            if self.writer is not None:
+                self.writer.write_states(i, t, atoms, pos, vel)
+            dt = min(self.dt, t1 - t)
+            vel += 0.5 * dt * acc
+            pos += dt * vel
+            t += dt
+            newlyLost = ~lost & (np.hypot(pos[:, 0], pos[:, 1]) > self.rWall)
+            lost |= newlyLost
+            if self._losses is not None and newlyLost.any():
+                self._losses.update(self.trapIndex(pos[newlyLost, 2]))
+            acc = self.acceleration(t, pos)
+            acc[lost] = 0
+            vel += 0.5 * dt * acc
+            if self._stats is not None:
+                sample = self._observe(sample, t, pos, vel, lost, newlyLost)
+        if self.writer is not None:
+            self.writer.write_states(steps, t, atoms, pos, vel, final = True)
+        self.steps += steps
+        return lost
+
+    def switchTimes(self, t0, t1):
+        """
+        Trap on and off times between t0 and t1, ending with t1
+        """
+        switches = [self.slower.trapOnTime, self.slower.trapOffTime]
+        if self.envelope is not None:
+            switches.append(self.slower.trapOffTime + self.envelope.tail)
+        switches = np.concatenate(switches)
+        return np.unique(np.append(switches[(switches > t0) & (switches < t1)], t1))
+
+    def _pushAdaptive(self, pos, vel, t0, t1, atoms, resume = None):
+        """
+        push() between trap switch times; the active traps are fixed within 
+        each interval, each interval restarts from dtMin with a fresh force
+        """
+        switches = self.switchTimes(t0, t1)
+        if resume is None:
+            lost = np.zeros(pos.shape[0], dtype = bool)
+            t = t0
+            i = 0
+            first = 0
+            sample = self._firstSample(t0, pos, vel, lost)
+        else:
+            lost, t, i, first, sample = [resume[name] for name in ('lost', 't', 'step', 'interval', 'sample')]
+        for interval in range(first, switches.size):
+            tSwitch = switches[interval]
+            if resume is None:
+                fieldTime = 0.5 * (t + tSwitch) # active traps of this interval
+                acc = self.acceleration(t, pos, fieldTime)
+                acc[lost] = 0
+                dt = self.dtMin
+            else: # continue within the interval of the checkpoint
+                fieldTime, acc, dt = resume['fieldTime'], resume['acc'], resume['dt']
+                resume = None
+            while t < tSwitch:
+                if self._checkpointer is not None and self._checkpointer.due():
+                    self._saveCheckpoint(pos, vel, lost = lost, t = t, step = i, interval = interval, sample = sample,
+                                         fieldTime = fieldTime, acc = acc, dt = dt)
+                if self.writer is not None:
+                    self.writer.write_states(i, t, atoms, pos, vel)
+                dt = min(dt, tSwitch - t)
+                vel += 0.5 * dt * acc
+                dx = dt * vel
+                pos += dx
+                t = tSwitch if dt == tSwitch - t else t + dt
+                newlyLost = ~lost & (np.hypot(pos[:, 0], pos[:, 1]) > self.rWall)
+                lost |= newlyLost
+                if self._losses is not None and newlyLost.any():
+                    self._losses.update(self.trapIndex(pos[newlyLost, 2]))
+                accNew = self.acceleration(t, pos, fieldTime)
+                accNew[lost] = 0
+                vel += 0.5 * dt * accNew
+                i += 1
+                if self._stats is not None:
+                    sample = self._observe(sample, t, pos, vel, lost, newlyLost)
+
+                # local force gradient from the change of force over the step
+                dxNorm = np.linalg.norm(dx, axis = 1)
+                moving = ~lost & (dxNorm > 0)
+                stiffness = np.linalg.norm(accNew - acc, axis = 1)[moving] / dxNorm[moving]
+                k = np.quantile(stiffness, self.quantile) if stiffness.size else 0
+                dt = self.dtMax if k <= 0 else np.clip(self.eta / np.sqrt(k), self.dtMin, self.dtMax)
+                acc = accNew
+        if self.writer is not None:
+            self.writer.write_states(i, t, atoms, pos, vel, final = True)
+        self.steps += i
+        return lost
+
+    def captured(self, pos, lost):
+        """
+        Atoms within the last trap at the end of the deceleration
+        """
+        return ~lost & (abs(pos[:, 2] - self.slower.trapCenter[-1]) <= self.slower.trapSpace)
+
+    def defaults(self, beam = None, velocityBins = None):
+        """
+        Default beam, centered at the slower initial velocity, and final
+        velocity histogram bins
+        """
+        if beam is None:
+            beam = SupersonicBeam(self.slower.initialV)
+        if velocityBins is None:
+            velocityBins = np.linspace(-50, 50, 101) + self.slower.trapVelocity[-1]
+        return beam, velocityBins
+
+    def numBlocks(self, nAtoms):
+        return -(-nAtoms // self.chunkSize)
+
+    def runBlock(self, block, nAtoms, beam, entropy, velocityBins, resume = None):
+        """
+        Simulate one chunk, atoms block * chunkSize onwards, of an ensemble of 
+        nAtoms; each block draws from its own random stream spawned from the 
+        run entropy, so a block gives the same result wherever it runs
+        resume: state of a checkpoint written within this block
+        return: SimulationResult of the block
+        """
+        start = block * self.chunkSize
+        n = min(self.chunkSize, nAtoms - start)
+        if resume is None:
+            rng = np.random.default_rng(np.random.SeedSequence(entropy, spawn_key = (block,)))
+            z0, v0 = self.slower.synchronousAtom(self.startTime)
+            pos, vel = beam.sample(n, rng, z0)
+            self.steps = self.forceEvaluations = 0
+            self._stats = None if self.stats is None else self.stats.empty()
+            self._losses = None if self.writer is None else LossTally(self.slower.numTraps)
+        else:
+            pos, vel = resume['pos'], resume['vel']
+            self.steps, self.forceEvaluations, self._stats = resume['steps'], resume['forceEvaluations'], resume['stats']
+
+        result = SimulationResult(velocityBins)
+        lost = self.push(pos, vel, self.startTime, self.endTime, np.arange(start, start + n), resume)
+        result.stats, self._stats = self._stats, None
+        fixedSteps = int(np.ceil((self.endTime - self.startTime) / self.dt - 1e-9))
+        result.steps = self.steps
+        result.forceEvaluations = self.forceEvaluations
+        result.fixedSteps = fixedSteps
+        result.fixedEvaluations = fixedSteps + 1
+        captured = self.captured(pos, lost)
+        result.add(vel, captured, lost)
+        if self.writer is not None:
+            self.writer.append('chunks', [n, captured.sum(), lost.sum()])
+            alive = np.bincount(self.trapIndex(pos[~lost, 2]), minlength = self.slower.numTraps)
+            self.writer.append('traps', np.stack([self._losses.counts, alive], axis = 1))
+            self._losses = None
+        return result
+
+    def run(self, nAtoms, beam = None, seed = None, velocityBins = None, checkpoint = None, checkpointEvery = 600.):
+        """
+        Simulate nAtoms in chunks of chunkSize atoms
+        beam: SupersonicBeam, default centered at the slower initial velocity
+        checkpoint: file the run state is saved to every checkpointEvery
+                    seconds, removed once the run completes; see resume()
+        return: SimulationResult
+        """
+        beam, velocityBins = self.defaults(beam, velocityBins)
+        entropy = np.random.SeedSequence(seed).entropy
+        checkpointer = None if checkpoint is None else Checkpointer(checkpoint, checkpointEvery)
+        return self._run(nAtoms, beam, entropy, velocityBins, checkpointer)
+
+    def resume(self, path, checkpointEvery = 600.):
+        """
+        Continue the run of a checkpoint, bit for bit as if never stopped; 
+        the simulator must be configured as the one that wrote it
+        return: SimulationResult
+        """
+        arrays, objects = loadCheckpoint(path)
+        nAtoms, beam, entropy = objects['nAtoms'], objects['beam'], objects['entropy']
+        if objects['params'] != self.params(nAtoms, beam, entropy):
+            raise ValueError("Checkpoint {:} was written by a differently configured simulator".format(path))
+        print("[*] Resuming from {:}: block {:d} of {:d}, t = {:.4f} ms".format(
+            path, objects['block'] + 1, self.numBlocks(nAtoms), objects['loop']['t'] * 1e3))
+        resume = dict(objects['loop'], steps = objects['steps'], forceEvaluations = objects['forceEvaluations'],
+                      stats = objects['stats'], **arrays)
+        return self._run(nAtoms, beam, entropy, objects['velocityBins'],
+                         Checkpointer(path, checkpointEvery), objects, resume)
+
+    def _run(self, nAtoms, beam, entropy, velocityBins, checkpointer, state = None, resume = None):
+        if checkpointer is not None and self.writer is not None:
+            raise ValueError("Checkpoints do not cover the states streamed to the writer, use one or the other")
+        result = SimulationResult(velocityBins) if state is None else state['result']
+        first = 0 if state is None else state['block']
+        if self.writer is not None:
+            self.writer.params.update(self.params(nAtoms, beam, entropy))
+            if 'chunks' not in self.writer.fields:
+                self.writer.add_field('chunks', (3,), np.int64) # atoms, captured, lost
+            if 'traps' not in self.writer.fields: # per chunk, atoms lost at and alive at the end nearest to each trap
+                self.writer.add_field('traps', (self.slower.numTraps, 2), np.int64)
+
+        self._checkpointer = checkpointer
+        params = None if checkpointer is None else self.params(nAtoms, beam, entropy)
+        try:
+            for block in range(first, self.numBlocks(nAtoms)):
+                self._context = {'nAtoms': nAtoms, 'beam': beam, 'entropy': entropy, 'velocityBins': velocityBins,
+                                 'block': block, 'result': result, 'params': params}
+                result.merge(self.runBlock(block, nAtoms, beam, entropy, velocityBins,
+                                           resume if block == first else None))
+        finally:
+            self._checkpointer = self._context = None
+                
+        if self.writer is not None:
+            self.writer.flush()
+        if checkpointer is not None:
+            if checkpointer.count:
+                print("[*] {:d} checkpoints, {:.2%} of the run time".format(checkpointer.count, checkpointer.overhead()))
+            checkpointer.remove()
+        return result
+
+    def _saveCheckpoint(self, pos, vel, **loop):
+        """
+        Save the run context and the integrator loop state (arrays go to the
+        npz, the rest is pickled with the partial results)
+        """
+        arrays = {'pos': pos, 'vel': vel}
+        arrays.update({name: value for name, value in loop.items() if isinstance(value, np.ndarray)})
+        objects = dict(self._context, steps = self.steps, forceEvaluations = self.forceEvaluations, stats = self._stats,
+                       loop = {name: value for name, value in loop.items() if not isinstance(value, np.ndarray)})
+        self._checkpointer.save(arrays, objects)
+
+    def params(self, nAtoms, beam, seed):
+        """
+        Run parameters recorded with the saved results and checked on resume,
+        seed being the entropy the block random streams are spawned from;
+        the field map and the envelope are identified by content hashes
+        """
+        s = self.slower
+        lf, envelope = self.localField, self.envelope
+        mapKey = lf.key if lf.key is not None else artifacts.key('LocalField', {
+            'field': lf.field if lf.field is not None else lf._absfield, 'channels': lf.channels,
+            'origin': list(lf.origin), 'resolution': lf.resolution})
+        envelopeKey = None if envelope is None else artifacts.key('EnvelopeTable', {
+            'bands': envelope.bands, 'start': envelope.start, 't0': envelope.t0, 'dt': envelope.dt})
+        return {'initialV': s.initialV, 'finalV': s.finalV, 'accRatio': s.accRatio,
+                'divTrapIdx': s.divTrapIdx, 'geoOffset': s.geoOffset, 'timeOffset': s.timeOffset,
+                'dt': self.dt, 'chunkSize': self.chunkSize, 'method': self.method, 'nAtoms': nAtoms,
+                'integrator': self.integrator, 'dtMin': self.dtMin, 'dtMax': self.dtMax, 'eta': self.eta,
+                'quantile': self.quantile, 'mass': self.mass, 'seed': seed, 'beam': dict(vars(beam)),
+                'mapResolution': self.localField.resolution, 'mapShape': list(self.localField.shape), 'map': mapKey,
+                'envelope': envelopeKey,
+                'waveform': None if self.envelope is None else type(self.envelope.waveform).__name__,
+                'waveformTail': None if self.envelope is None else self.envelope.tail}
+
+
+if __name__ == '__main__':
+    import os
+    import argparse
+    from slower import Slower
+    from coilfield import trapLocalField
+
+    parser = argparse.ArgumentParser(description = 'Monte Carlo run of the moving trap slower')
+    parser.add_argument('--checkpoint', help = 'checkpoint file, the run resumes from it if it exists')
+    parser.add_argument('--every', type = float, default = 600., help = 'seconds between checkpoints')
+    args = parser.parse_args()
+
+    slower = Slower(480, 50, 1)
+    sim = Simulator(slower, trapLocalField(current = 400), dt = 1e-7, chunkSize = 500, integrator = 'adaptive')
+    print(slower)
+    if args.checkpoint and os.path.exists(args.checkpoint):
+        print(sim.resume(args.checkpoint, args.every))
+    else:
+        print(sim.run(1000, seed = 0, checkpoint = args.checkpoint, checkpointEvery = args.every))
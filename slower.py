@@ -4,8 +4,9 @@ Created on Fri Oct 13 13:53:06 2017
 
 @author: Yu Lu
 """
+import copy
 import numpy as np
-import matplotlib.pyplot as plt 
+import instrument
 # Constants needed 
 u0 = 4 * np.pi * 1e-7
 mj = 0.5
@@ -51,8 +52,9 @@ class Slower:
     totalLength = (numTraps - 1) * trapSpace # Total length only counting trap centers
     stage1Length = divTrapIdx  * trapSpace    
     stage2Length = totalLength - stage1Length
+    trapIdx = np.arange(0, numTraps).astype(np.int32)
         
-    def __init__(self, initialV, finalV, accRatio, geoOffset = 0, timeOffset = 0):
+    def __init__(self, initialV, finalV, accRatio, geoOffset = 0, timeOffset = 0, divTrapIdx = None):
         """
         Initialize slower geometry and dynamics settings;
         All geometry parameters are calculating from trap center;
@@ -70,19 +72,76 @@ class Slower:
         self.geoOffset = geoOffset
         self.timeOffset = timeOffset
 
+        ### Trap where the 2nd stage starts, overrides the class default
+        if divTrapIdx is not None:
+            self.divTrapIdx = divTrapIdx
+
         ### Derived configurations 
+        self._derive()
+
+        ## Properties of traps, derived lazily and only once 
+        self._arrays = {}
+
+
+    def _derive(self):
+        """
+        Derived scalar configurations of the two stages
+        """
+        self.stage1Length = self.divTrapIdx  * self.trapSpace
+        self.stage2Length = self.totalLength - self.stage1Length
         self.stage1Acc, self.stage2Acc = self._acceleration()
-        self.middleV = np.sqrt(finalV**2 - 2 * self.stage2Acc * self.stage2Length)
+        self.middleV = np.sqrt(self.finalV**2 - 2 * self.stage2Acc * self.stage2Length)
         self.stage1Time, self.stage2Time, self.totalTime = self._totalTime()
 
-        ## Properties of traps
-        self.trapIdx = np.arange(0, self.numTraps).astype(np.int32)
-        self.trapCenter = self._trapCenter()
-        self.trapLeftCoil = self._trapLeftCoil()
-        self.trapRightCoil = self._trapRightCoil()
-        self.trapOnTime = self._trapOnTime()
-        self.trapOffTime = self._trapOffTime()
-        self.trapPulseLength = self._trapPulseLength()
+    def _lazy(self, name):
+        """
+        Compute-once access to the derived trap arrays
+        """
+        if name not in self._arrays:
+            self._arrays[name] = getattr(self, '_' + name)()
+        return self._arrays[name]
+
+    def replace(self, **configs):
+        """
+        Copy of this slower with some configurations changed, e.g.
+        slower.replace(initialV = 500, accRatio = 0.8); derived trap arrays 
+        not depending on a changed configuration are shared, not recomputed
+        """
+        unknown = set(configs) - self._configs
+        if unknown:
+            raise TypeError("Unknown slower configuration: {:}".format(', '.join(sorted(unknown))))
+        
+        new = copy.copy(self)
+        new.__dict__.update(configs)
+        changed = {key for key, value in configs.items() if value != getattr(self, key)}
+        if changed & self._dynamics:
+            new._derive()
+        new._arrays = {name: array for name, array in self._arrays.items()
+                       if not self._dependencies[name] & changed}
+        return new
+
+    # configurations and the derived trap arrays depending on them
+    _dynamics = {'initialV', 'finalV', 'accRatio', 'divTrapIdx'}
+    _configs = _dynamics | {'geoOffset', 'timeOffset'}
+    _dependencies = {
+        'trapCenter': {'geoOffset'},
+        'trapLeftCoil': {'geoOffset'},
+        'trapRightCoil': {'geoOffset'},
+        'trapVelocity': _dynamics,
+        'trapCenterTime': _dynamics | {'timeOffset'},
+        'trapOnTime': _dynamics | {'timeOffset'},
+        'trapOffTime': _dynamics | {'timeOffset'},
+        'trapPulseLength': _dynamics | {'timeOffset'},
+    }
+
+    trapCenter = property(lambda self: self._lazy('trapCenter'))
+    trapLeftCoil = property(lambda self: self._lazy('trapLeftCoil'))
+    trapRightCoil = property(lambda self: self._lazy('trapRightCoil'))
+    trapVelocity = property(lambda self: self._lazy('trapVelocity'))
+    trapCenterTime = property(lambda self: self._lazy('trapCenterTime'))
+    trapOnTime = property(lambda self: self._lazy('trapOnTime'))
+    trapOffTime = property(lambda self: self._lazy('trapOffTime'))
+    trapPulseLength = property(lambda self: self._lazy('trapPulseLength'))
 
 
     def __str__(self):
@@ -123,51 +182,101 @@ class Slower:
         return self.geoOffset + self.trapSpace * self.trapIdx
 
     def _trapLeftCoil(self):
-        return self._trapCenter() - self.trapSpace
+        return self.trapCenter - self.trapSpace
 
     def _trapRightCoil(self):
-        return self._trapCenter() + self.trapSpace
+        return self.trapCenter + self.trapSpace
 
     def _trapVelocity(self):
         """
         Calculate the effective moving velocity of specified trap
         """
-        pos = self._trapCenter()
-        velocity = []
-        for i in self.trapIdx:
-            if i  <= self.divTrapIdx:
-                v = np.sqrt(self.initialV**2 + 2 * self.stage1Acc * (pos[i] - self.geoOffset))
-            else:
-                v = np.sqrt(self.middleV**2 + 2 * self.stage2Acc * (pos[i] - self.geoOffset - self.stage1Length))
-            velocity.append(v)
-            
-        return np.array(velocity)
+        pos = self.trapSpace * self.trapIdx # distance from the 1st trap 
+        div = self.divTrapIdx + 1
+        stage1 = np.sqrt(self.initialV**2 + 2 * self.stage1Acc * pos[:div])
+        stage2 = np.sqrt(self.middleV**2 + 2 * self.stage2Acc * (pos[div:] - self.stage1Length))
+        return np.concatenate([stage1, stage2])
 
     def _trapCenterTime(self):
         """
         Time when atoms arrive at the trap center
         """ 
-        velocity = self._trapVelocity()
-        times = []
-        for i in self.trapIdx:
-            if i <= self.divTrapIdx:
-                times.append(self.timeOffset + (velocity[i]-velocity[0])/self.stage1Acc)
-            else:
-                times.append(self.timeOffset
-                             + (velocity[self.divTrapIdx] - velocity[0]) / self.stage1Acc
-                             + (velocity[i] - velocity[self.divTrapIdx]) / self.stage2Acc)
-        return np.array(times)
+        velocity = self.trapVelocity
+        div = self.divTrapIdx + 1
+        stage1 = (velocity[:div] - velocity[0]) / self.stage1Acc
+        stage2 = (velocity[self.divTrapIdx] - velocity[0]) / self.stage1Acc + (velocity[div:] - velocity[self.divTrapIdx]) / self.stage2Acc
+        return self.timeOffset + np.concatenate([stage1, stage2])
 
     def _trapOnTime(self):
-        return self._trapCenterTime() - self.trapSpace / self._trapVelocity()
+        return self.trapCenterTime - self.trapSpace / self.trapVelocity
     
     def _trapOffTime(self):
-        return self._trapCenterTime() + self.trapSpace / self._trapVelocity()
+        return self.trapCenterTime + self.trapSpace / self.trapVelocity
 
     def _trapPulseLength(self):
-        return self._trapOffTime() - self._trapOnTime()
+        return self.trapOffTime - self.trapOnTime
+
+    def synchronousAtom(self, t):
+        """
+        Position and velocity of the synchronous atom, the one staying at the 
+        trap centers, at time t (scalar or array); constant velocity outside 
+        the slower
+        """
+        t = np.asarray(t, dtype = float)
+        k = np.clip(np.searchsorted(self.trapCenterTime, t, side = 'right') - 1, 0, self.numTraps - 1)
+        acc = np.where(k < self.divTrapIdx, self.stage1Acc, self.stage2Acc)
+        acc = np.where((t < self.trapCenterTime[0]) | (k == self.numTraps - 1), 0, acc)
+        dt = t - self.trapCenterTime[k]
+        return (self.trapCenter[k] + self.trapVelocity[k] * dt + 0.5 * acc * dt**2,
+                self.trapVelocity[k] + acc * dt)
+
+    def activeTraps(self, t, tail = 0):
+        """
+        Traps energized at time t, i.e. trapOnTime <= t < trapOffTime; both
+        times increase with the trap index, so the active traps at any time
+        are the contiguous index range [first, last)
+        t: time or array of times
+        tail: current decay time after trapOffTime, see waveforms.Waveform
+        return: first, last
+        """
+        first = np.searchsorted(self.trapOffTime + tail if tail else self.trapOffTime, t, side = 'right')
+        last = np.searchsorted(self.trapOnTime, t, side = 'right')
+        return first, np.maximum(first, last)
+
+    def _weights(self, t, envelope):
+        """
+        Active traps at time t and their current relative to the map, None
+        for ideal rectangular pulses
+        """
+        if envelope is None:
+            first, last = self.activeTraps(t)
+            return first, last, None
+        first, last = self.activeTraps(t, envelope.tail)
+        return first, last, envelope(t, np.arange(first, last))
+
+    def magField(self, t, xyz, localField, method = 'linear', envelope = None):
+        """
+        Magnetic field at time t at positions xyz in shape (N, 3), superposing 
+        only the active traps, each being the single trap map localField 
+        translated to its trap center
+        envelope: waveforms.EnvelopeTable of finite rise and fall currents,
+                  default ideal rectangular pulses
+        return: B in shape (N, 3), mask of positions inside an active trap map
+        """
+        first, last, weights = self._weights(t, envelope)
+        return localField.superpose_field(self.trapCenter[first:last], xyz, weights, method)
+
+    def fieldGradient(self, t, xyz, localField, method = 'linear', envelope = None):
+        """
+        Gradient of |B| at time t at positions xyz in shape (N, 3), see magField
+        return: gradient in shape (N, 3), |B|, mask of positions inside an active trap map
+        """
+        first, last, weights = self._weights(t, envelope)
+        return localField.superpose_gradient(self.trapCenter[first:last], xyz, weights, method)
 
     def plot(self):
+        import matplotlib.pyplot as plt # plotting only, keeps the module import light
+        
         fig, ax = plt.subplots(1,2, figsize = (10,8))
         ax[0].plot(self.trapIdx, self.trapCenter, label = 'trap center')
         ax[0].set_xlabel('trap idx')
@@ -179,6 +288,8 @@ class Slower:
         
     
 
+instrument.register('slower', globals())
+
 if __name__ == '__main__':
     slower = Slower(480, 50, 1, geoOffset = 1, timeOffset = 1)
     trap = Trap(1, slower)
@@ -0,0 +1,145 @@
+# storage.py ---
+#
+# Filename: storage.py
+# Description:
+#            Streaming on-disk result sink: records are appended
+#          in fixed size chunks to raw binary files, one per field,
+#          with a json header holding dtypes, shapes, counts and the
+#          run parameters; readers memory map the fields
+# Author:    Yu Lu
+# Email:     yulu@utexas.edu
+# Github:    https://github.com/SuperYuLu
+#
+
+import os
+import json
+import tempfile
+import numpy as np
+
+
+STATE_COLUMNS = ('t', 'atom', 'x', 'y', 'z', 'vx', 'vy', 'vz')
+
+
+class ResultWriter:
+    """
+    Append-only store of records in the directory path; each field holds
+    records of a fixed shape and dtype, buffered in memory and written
+    chunkSize records at a time
+    fields: {name: (record shape, dtype)}
+    params: run parameters saved as metadata
+    every, particleStride: downsampling of particle states, keep every
+                           n-th saved step and every n-th atom
+    """
+    def __init__(self, path, fields = None, params = None, chunkSize = 65536, every = 1, particleStride = 1):
+        self.path = path
+        self.params = {} if params is None else dict(params)
+        self.chunkSize = chunkSize
+        self.every = every
+        self.particleStride = particleStride
+        self.fields = {}
+        self._buffers = {}
+        os.makedirs(path, exist_ok = True)
+
+        fields = {} if fields is None else dict(fields)
+        fields.setdefault('states', ((len(STATE_COLUMNS),), np.float64))
+        for name, (shape, dtype) in fields.items():
+            self.add_field(name, shape, dtype)
+
+    def add_field(self, name, shape, dtype = np.float64):
+        self.fields[name] = {'shape': list(shape), 'dtype': np.dtype(dtype).str, 'count': 0}
+        self._buffers[name] = []
+        open(self._file(name), 'wb').close()
+        self._save_header()
+
+    def _file(self, name):
+        return os.path.join(self.path, name + '.bin')
+
+    def _save_header(self):
+        """
+        Atomically rewrite the header, counts only cover flushed records
+        """
+        header = {'params': self.params, 'fields': self.fields,
+                  'policy': {'every': self.every, 'particleStride': self.particleStride}}
+        fd, tmp = tempfile.mkstemp(dir = self.path, suffix = '.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(header, f, indent = 1, default = float)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, os.path.join(self.path, 'header.json'))
+
+    def append(self, name, records):
+        """
+        Append records in shape (n,) + record shape to a field
+        """
+        field = self.fields[name]
+        records = np.asarray(records, dtype = field['dtype']).reshape([-1] + field['shape'])
+        self._buffers[name].append(records)
+        if sum(len(r) for r in self._buffers[name]) >= self.chunkSize:
+            self.flush(name)
+
+    def write_states(self, step, t, atoms, pos, vel, final = False):
+        """
+        Append particle states of a saved step, subject to the downsampling policy
+        atoms: global atom indices
+        final: states after the last step, kept whatever the step
+        """
+        if step % self.every and not final:
+            return
+        keep = atoms % self.particleStride == 0
+        n = int(keep.sum())
+        records = np.empty((n, len(STATE_COLUMNS)))
+        records[:, 0] = t
+        records[:, 1] = atoms[keep]
+        records[:, 2:5] = pos[keep]
+        records[:, 5:8] = vel[keep]
+        self.append('states', records)
+
+    def flush(self, name = None):
+        names = self.fields if name is None else [name]
+        for name in names:
+            if not self._buffers[name]:
+                continue
+            records = np.concatenate(self._buffers[name])
+            with open(self._file(name), 'ab') as f:
+                f.write(records.tobytes())
+            self.fields[name]['count'] += len(records)
+            self._buffers[name] = []
+        self._save_header()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ResultReader:
+    """
+    Read side of ResultWriter, fields are memory mapped so slices are
+    loaded on access only
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'header.json')) as f:
+            header = json.load(f)
+        self.params = header['params']
+        self.policy = header['policy']
+        self.fields = header['fields']
+
+    def __getitem__(self, name):
+        field = self.fields[name]
+        shape = tuple([field['count']] + field['shape'])
+        if field['count'] == 0:
+            return np.empty(shape, dtype = field['dtype'])
+        return np.memmap(os.path.join(self.path, name + '.bin'), dtype = field['dtype'], mode = 'r', shape = shape)
+
+    def states(self, atom = None):
+        """
+        Saved particle states as a dict of columns, optionally of one atom
+        """
+        data = self['states']
+        if atom is not None:
+            data = data[data[:, 1] == atom]
+        return {column: data[:, i] for i, column in enumerate(STATE_COLUMNS)}
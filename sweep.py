@@ -0,0 +1,175 @@
+# sweep.py ---
+#
+# Filename: sweep.py
+# Description:
+#            Parameter sweep over slower configurations, points
+#          are evaluated in a process pool and streamed into one
+#          csv table; finished points are skipped on rerun
+# Author:    Yu Lu
+# Email:     yulu@utexas.edu
+# Github:    https://github.com/SuperYuLu
+#
+
+import os
+import csv
+import json
+import hashlib
+import inspect
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import settings
+import artifacts
+from slower import Slower
+from movingTraps import slower, onAxisField, effectiveField
+from functions import trapDepth
+
+
+PARAMETERS = ('initialV', 'finalV', 'accRatio', 'current', 'divTrapIdx')
+
+
+def defaults():
+    """
+    Single configuration from settings.py
+    """
+    return {'initialV': settings.initialV, 'finalV': settings.finalV, 'accRatio': settings.accRatio,
+            'current': settings.current, 'divTrapIdx': Slower.divTrapIdx}
+
+
+def grid(**values):
+    """
+    All combinations of the given parameter values, e.g.
+    grid(accRatio = [0.8, 1, 1.2], divTrapIdx = [100, 179]);
+    parameters not given are taken from settings.py
+    """
+    unknown = set(values) - set(PARAMETERS)
+    if unknown:
+        raise TypeError("Unknown sweep parameter: {:}".format(', '.join(sorted(unknown))))
+    names = sorted(values)
+    points = []
+    for combo in itertools.product(*[values[name] for name in names]):
+        point = defaults()
+        point.update(zip(names, combo))
+        points.append(point)
+    return points
+
+
+def pointKey(point, evaluate = None):
+    """
+    Hash of a parameter point and, if given, of the evaluate function (name
+    and source of its module); identifies finished points in the output
+    """
+    params = {name: float(point[name]) for name in PARAMETERS}
+    if evaluate is not None:
+        params['evaluate'] = evaluate.__module__ + '.' + evaluate.__qualname__
+        params['code'] = artifacts.codeVersion(inspect.getsourcefile(evaluate))
+    text = json.dumps(params, sort_keys = True)
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+def evaluateSchedule(initialV, finalV, accRatio, current, divTrapIdx):
+    """
+    Default sweep point: schedule summary of the slower, peak on-axis field 
+    of a single trap and the minimum co-moving trap depth of the two stages
+    """
+    s = Slower(initialV, finalV, accRatio, divTrapIdx = int(divTrapIdx))
+    z = np.linspace(-slower.coilSpace * 2, slower.coilSpace * 2, 100) # same window as singleTrap.onAxisMagField
+    z = np.vstack([z, z])
+    B = onAxisField(z, [0., 0.], current, slower.windings())
+    B_eff = effectiveField(z, B, np.array([s.stage1Acc, s.stage2Acc]))
+    frontPeak, backPeak = slower.trapsFieldPeak(z, B_eff, [0., 0.])
+    return {'stage1Acc': s.stage1Acc, 'stage2Acc': s.stage2Acc, 'middleV': s.middleV,
+            'totalTime': s.totalTime, 'minPulseLength': s.trapPulseLength.min(),
+            'peakField': abs(B).max(),
+            'minComovingDepth': trapDepth(np.minimum(frontPeak, backPeak)).min() * 1e3}
+
+
+def _evaluate(evaluate, point):
+    return evaluate(**{name: point[name] for name in PARAMETERS})
+
+
+class Sweep:
+    """
+    Run evaluate(**point) for every parameter point across a process pool,
+    appending a row per point to the csv output as soon as it completes;
+    with a SharedField spec as field, workers attach the published field
+    map once at startup, evaluate gets it from sharedfield.workerField()
+    """
+    def __init__(self, points, output, evaluate = evaluateSchedule, workers = None, field = None):
+        self.points = points
+        self.output = output
+        self.evaluate = evaluate  # module level function, results as a dict of scalars
+        self.workers = workers    # default to the number of cpus
+        self.field = field
+
+    def repair(self):
+        """
+        Drop a row left incomplete by a killed run, so its point reruns
+        """
+        if not os.path.exists(self.output):
+            return
+        with open(self.output, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                print("[!] Sweep: dropping the incomplete last row of {:}".format(self.output))
+                f.truncate(data.rfind(b'\n') + 1)
+
+    def completed(self):
+        """
+        Keys of the points already in the output
+        """
+        if not os.path.exists(self.output):
+            return set()
+        with open(self.output, newline = '') as f:
+            return {row['key'] for row in csv.DictReader(f)}
+
+    def pending(self):
+        done = self.completed()
+        return [point for point in self.points if pointKey(point, self.evaluate) not in done]
+
+    def run(self):
+        self.repair()
+        points = self.pending()
+        print("[*] Sweep: {:d} points, {:d} done, {:d} to run ...".format(
+            len(self.points), len(self.points) - len(points), len(points)))
+        if not points:
+            return
+
+        header = None
+        if os.path.exists(self.output) and os.path.getsize(self.output) > 0:
+            with open(self.output, newline = '') as f:
+                header = next(csv.reader(f))
+                
+        pool = {}
+        if self.field is not None:
+            import sharedfield # multiprocessing.shared_memory, python 3.8+
+            pool = {'initializer': sharedfield.initWorker, 'initargs': (self.field,)}
+        with open(self.output, 'a', newline = '') as f, ProcessPoolExecutor(self.workers, **pool) as pool:
+            writer = None
+            futures = {pool.submit(_evaluate, self.evaluate, point): point for point in points}
+            for future in as_completed(futures):
+                point = futures[future]
+                try:
+                    result = future.result()
+                except Exception as err:
+                    print("[!] Sweep point {:} failed: {:}".format(point, err))
+                    continue
+
+                row = dict(key = pointKey(point, self.evaluate), **point, **result)
+                if writer is None:
+                    if header is not None and set(header) != set(row):
+                        for pending in futures:
+                            pending.cancel()
+                        raise ValueError("Sweep: the columns of {:} ({:}) differ from those evaluated now ({:}), "
+                                         "write to a new output".format(self.output, ', '.join(header), ', '.join(row)))
+                    writer = csv.DictWriter(f, fieldnames = header or list(row))
+                    if header is None:
+                        writer.writeheader()
+                writer.writerow(row)
+                f.flush()
+                os.fsync(f.fileno())
+
+
+if __name__ == '__main__':
+    Sweep(grid(**settings.sweepGrid), settings.sweepOutput).run()
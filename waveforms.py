@@ -0,0 +1,127 @@
+# waveforms.py ---
+#
+# Filename: waveforms.py
+# Description:
+#            Coil current waveforms with finite rise and fall times,
+#          and the per trap current envelopes of a slower schedule
+#          tabulated on one shared time grid, so the time dependent
+#          field costs a table lookup per active trap
+# Author:    Yu Lu
+# Email:     yulu@utexas.edu
+# Github:    https://github.com/SuperYuLu
+#
+# Usage:
+#     envelope = EnvelopeTable(Slower(480, 50, 1), RLWaveform(tau = 2e-6), dt = 1e-7)
+#     sim = Simulator(slower, localField, envelope = envelope)
+#
+
+import numpy as np
+
+
+class Waveform:
+    """
+    Normalized current of a pulse switched on at tOn and off at tOff:
+    rise(t - tOn) while on, then the current reached at tOff times
+    fall(t - tOff); tail is how long the current takes to decay after tOff
+    """
+    tail = 0.
+
+    def rise(self, dt):
+        return np.ones_like(dt)
+
+    def fall(self, dt):
+        return np.zeros_like(dt)
+
+    def __call__(self, t, tOn, tOff):
+        t, tOn, tOff = np.broadcast_arrays(*[np.asarray(a, dtype = float) for a in (t, tOn, tOff)])
+        on = self.rise(np.clip(t - tOn, 0, None))
+        off = self.rise(np.clip(tOff - tOn, 0, None)) * self.fall(np.clip(t - tOff, 0, None))
+        return np.where(t < tOn, 0, np.where(t < tOff, on, np.where(t < tOff + self.tail, off, 0)))
+
+
+class RLWaveform(Waveform):
+    """
+    Coil driven as an RL circuit of time constant tau, the tail is cut
+    where the current falls below tol
+    """
+    def __init__(self, tau, tol = 1e-3):
+        self.tau = tau
+        self.tail = tau * np.log(1 / tol)
+
+    def rise(self, dt):
+        return 1 - np.exp(-dt / self.tau)
+
+    def fall(self, dt):
+        return np.exp(-dt / self.tau)
+
+
+class TrapezoidWaveform(Waveform):
+    """
+    Linear ramps, up over riseTime from tOn and down over fallTime from tOff
+    """
+    def __init__(self, riseTime, fallTime = None):
+        self.riseTime = riseTime
+        self.tail = riseTime if fallTime is None else fallTime
+
+    def rise(self, dt):
+        return np.clip(dt / self.riseTime, 0, 1) if self.riseTime > 0 else np.ones_like(dt)
+
+    def fall(self, dt):
+        return np.clip(1 - dt / self.tail, 0, 1) if self.tail > 0 else np.zeros_like(dt)
+
+
+class SampledWaveform(Waveform):
+    """
+    Measured edges: current samples after switching on (riseTimes from tOn,
+    rising to 1) and after switching off (fallTimes from tOff, falling from 1),
+    linearly interpolated, held at the last sample after the rise and 0
+    after the fall
+    """
+    def __init__(self, riseTimes, riseValues, fallTimes, fallValues):
+        self.riseTimes = np.asarray(riseTimes, dtype = float)
+        self.riseValues = np.asarray(riseValues, dtype = float)
+        self.fallTimes = np.asarray(fallTimes, dtype = float)
+        self.fallValues = np.asarray(fallValues, dtype = float)
+        self.tail = self.fallTimes[-1]
+
+    def rise(self, dt):
+        return np.interp(dt, self.riseTimes, self.riseValues)
+
+    def fall(self, dt):
+        return np.interp(dt, self.fallTimes, self.fallValues, right = 0)
+
+
+class EnvelopeTable:
+    """
+    Current envelope of every trap of a slower, relative to the field map
+    current, sampled every dt on one time grid; each trap only keeps the band
+    of samples from its on time to the end of its tail
+    amplitude: current scale, scalar or one per trap (e.g. sign or driver gain)
+    """
+    def __init__(self, slower, waveform, dt = 1e-7, amplitude = 1.):
+        self.waveform = waveform
+        self.tail = waveform.tail
+        self.dt = dt
+        tOn, tOff = slower.trapOnTime, slower.trapOffTime
+        self.t0 = tOn[0]
+
+        self.start = np.floor((tOn - self.t0) / dt).astype(np.intp) # first grid sample of each band
+        width = int((np.ceil((tOff + self.tail - self.t0) / dt).astype(np.intp) - self.start).max()) + 2
+        t = self.t0 + (self.start[:, None] + np.arange(width)) * dt
+        self.bands = waveform(t, tOn[:, None], tOff[:, None]) * np.broadcast_to(amplitude, tOn.shape)[:, None]
+
+    def __call__(self, t, traps):
+        """
+        Envelope at time t (scalar) of the given trap indices, linear in time
+        between grid samples
+        """
+        traps = np.asarray(traps, dtype = np.intp)
+        f = (t - self.t0) / self.dt - self.start[traps]
+        j = np.clip(np.floor(f).astype(np.intp), 0, self.bands.shape[1] - 2)
+        w = np.clip(f - j, 0, 1)
+        inside = (f >= 0) & (f <= self.bands.shape[1] - 1)
+        return np.where(inside, (1 - w) * self.bands[traps, j] + w * self.bands[traps, j + 1], 0)
+
+    @property
+    def nbytes(self):
+        return self.bands.nbytes + self.start.nbytes